@@ -6,6 +6,8 @@ from litestar.stores.redis import RedisStore
 from app.db import sqlalchemy_config
 from app.dependencies import provide_redis
 from app.routes import authentication, music
+from app.routes.music.controllers.job import music_job_updates
+from app.services import redispool
 from app.session import session_auth
 from app.settings import ENV, settings
 from app.templates import template_config
@@ -13,16 +15,25 @@ from app.templates import template_config
 api_router = Router(path="/api", route_handlers=[authentication.router, music.router])
 
 
+def register_stores(app: Litestar):
+    # Not created on import, a server that imports the app before forking would
+    # share one pool between its workers.
+    app.stores.register(
+        "sessions", RedisStore(redis=redispool.get_client()), allow_override=True
+    )
+
+
 app = Litestar(
     debug=settings.env != ENV.PRODUCTION,
     dependencies={"redis": Provide(provide_redis)},
     on_app_init=[session_auth.on_app_init],
+    on_startup=[register_stores],
+    on_shutdown=[music_job_updates.close, redispool.close_pool],
     plugins=[
         htmx.HTMXPlugin(),
         pydantic.PydanticPlugin(prefer_alias=True),
         sqlalchemy.SQLAlchemyPlugin(config=sqlalchemy_config),
     ],
     route_handlers=[api_router],
-    stores={"sessions": RedisStore.with_client(url=settings.redis_url)},
     template_config=template_config,
 )
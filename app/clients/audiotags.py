@@ -6,9 +6,11 @@ import re
 import shutil
 import traceback
 import uuid
+from contextlib import contextmanager
 from pathlib import Path
 
 import aiofiles.os
+import mutagen
 import mutagen.id3
 
 from app.models.music import TagsResponse
@@ -23,9 +25,56 @@ class AudioTags:
     _ALBUM_TAG = "TALB"
     _GROUPING_TAG = "TIT1"
     _ARTWORK_TAG = "APIC:"
+    _RESERVED_PADDING = 16 * 1024
 
-    def __init__(self, file_path: str):
-        self.tags = mutagen.id3.ID3(file_path)
+    def __init__(self, file_path: str | None = None):
+        self.tags = mutagen.id3.ID3(file_path) if file_path else mutagen.id3.ID3()
+        self._batch_depth = 0
+
+    @classmethod
+    def _get_padding(cls, info: mutagen.PaddingInfo):
+        # Keep room for later edits so they can be written in place instead of
+        # rewriting the whole file.
+        return max(info.get_default_padding(), cls._RESERVED_PADDING)
+
+    def _save(self):
+        if self._batch_depth == 0 and self.tags.filename:
+            self.tags.save(padding=AudioTags._get_padding)
+
+    def to_bytes(self):
+        buffer = io.BytesIO()
+        self.tags.save(buffer, padding=AudioTags._get_padding)
+        return buffer.getvalue()
+
+    @contextmanager
+    def batch(self):
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+        self._save()
+
+    def apply(
+        self,
+        title: str | None = None,
+        artist: str | None = None,
+        album: str | None = None,
+        grouping: str | None = None,
+        artwork_data: bytes | None = None,
+        artwork_mime_type: str | None = None,
+    ):
+        with self.batch():
+            if title is not None:
+                self.title = title
+            if artist is not None:
+                self.artist = artist
+            if album is not None:
+                self.album = album
+            if grouping is not None:
+                self.grouping = grouping
+            if artwork_data is not None:
+                self.set_artwork(data=artwork_data, mime_type=artwork_mime_type)
 
     def _get_tag(self, tag_name: str = ...) -> str | None:
         tag = self.tags.get(tag_name)
@@ -41,7 +90,7 @@ class AudioTags:
     def title(self, value: str):
         self.tags.delall(AudioTags._TITLE_TAG)
         self.tags.add(mutagen.id3.TIT2(text=[value]))
-        self.tags.save()
+        self._save()
 
     @property
     def artist(self):
@@ -51,7 +100,7 @@ class AudioTags:
     def artist(self, value: str):
         self.tags.delall(AudioTags._ARTIST_TAG)
         self.tags.add(mutagen.id3.TPE1(text=value))
-        self.tags.save()
+        self._save()
 
     @property
     def album(self):
@@ -61,7 +110,7 @@ class AudioTags:
     def album(self, value: str):
         self.tags.delall(AudioTags._ALBUM_TAG)
         self.tags.add(mutagen.id3.TALB(text=value))
-        self.tags.save()
+        self._save()
 
     @property
     def grouping(self):
@@ -71,7 +120,7 @@ class AudioTags:
     def grouping(self, value: str):
         self.tags.delall(AudioTags._GROUPING_TAG)
         self.tags.add(mutagen.id3.TIT1(text=value))
-        self.tags.save()
+        self._save()
 
     @property
     def artwork(self):
@@ -83,7 +132,7 @@ class AudioTags:
     def set_artwork(self, data: bytes, mime_type: str):
         self.tags.delall(AudioTags._ARTWORK_TAG)
         self.tags.add(mutagen.id3.APIC(mime=mime_type, data=data))
-        self.tags.save()
+        self._save()
 
     @classmethod
     def get_image_as_base64(cls, image: bytes, mime_type: str | None = None):
@@ -0,0 +1,93 @@
+import asyncio
+import logging
+import re
+
+import httpx
+
+from app.settings import settings
+
+logger = logging.getLogger(__name__)
+
+CONTENT_RANGE_PATTERN = re.compile(r"bytes (\d+)-\d+/(\d+|\*)")
+
+
+class IncompleteDownloadError(Exception):
+    pass
+
+
+def _is_retryable(error: Exception):
+    if isinstance(error, httpx.HTTPStatusError):
+        return (
+            error.response.status_code >= 500
+            or error.response.status_code == httpx.codes.TOO_MANY_REQUESTS
+        )
+    return isinstance(error, (httpx.TransportError, IncompleteDownloadError))
+
+
+def _get_total_size(response: httpx.Response):
+    if response.status_code == httpx.codes.PARTIAL_CONTENT:
+        if match := CONTENT_RANGE_PATTERN.match(
+            response.headers.get("Content-Range", "")
+        ):
+            total = match.group(2)
+            return int(total) if total != "*" else None
+        return None
+    if content_length := response.headers.get("Content-Length"):
+        return int(content_length)
+    return None
+
+
+def _get_range_start(response: httpx.Response):
+    if response.status_code == httpx.codes.PARTIAL_CONTENT:
+        if match := CONTENT_RANGE_PATTERN.match(
+            response.headers.get("Content-Range", "")
+        ):
+            return int(match.group(1))
+    return 0
+
+
+async def stream_file(
+    url: str,
+    chunk_size: int = settings.download_chunk_size,
+    max_retries: int = settings.download_max_retries,
+):
+    downloaded = 0
+    total = None
+    attempt = 0
+    async with httpx.AsyncClient(
+        follow_redirects=True, timeout=settings.download_timeout
+    ) as client:
+        while True:
+            # Content-Length is only comparable to the bytes written when the
+            # body is not content-encoded.
+            headers = {"Accept-Encoding": "identity"}
+            if downloaded:
+                headers["Range"] = f"bytes={downloaded}-"
+            try:
+                async with client.stream("GET", url, headers=headers) as response:
+                    response.raise_for_status()
+                    total = _get_total_size(response) or total
+                    # Servers that ignore the Range header resend the file from
+                    # the start, so skip what has already been yielded.
+                    skip = downloaded - _get_range_start(response)
+                    async for chunk in response.aiter_bytes(chunk_size):
+                        if skip > 0:
+                            chunk, skip = chunk[skip:], skip - len(chunk)
+                            if not chunk:
+                                continue
+                        downloaded += len(chunk)
+                        yield chunk
+                if total is not None and downloaded != total:
+                    raise IncompleteDownloadError(
+                        f"Received {downloaded} of {total} bytes from {url}"
+                    )
+                return
+            except Exception as e:
+                attempt += 1
+                if attempt > max_retries or not _is_retryable(e):
+                    raise
+                logger.warning(
+                    f"Retrying download of {url} from byte {downloaded} "
+                    f"({attempt}/{max_retries}): {e!r}"
+                )
+                await asyncio.sleep(2 ** (attempt - 1))
@@ -1,24 +1,391 @@
 import asyncio
+import fcntl
+import json
+import logging
+import os
+import tempfile
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager, nullcontext
+from functools import partial
 from pathlib import Path
+from typing import AsyncIterable, Awaitable, Callable, Literal, TypeVar
 
+import aiofiles
+from pydantic import BaseModel
 
-async def convert_audio_to_mp3(audio_file: str):
-    file = Path(audio_file)
-    if file.suffix == ".mp3":
-        return audio_file
-    output_filename = f"{file.stem}.mp3"
-    process = await asyncio.subprocess.create_subprocess_exec(
-        "ffmpeg",
-        "-i",
-        audio_file,
-        "-b:a",
-        "320k",
-        output_filename,
+from app.clients import audiotags
+from app.settings import settings
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+MP3_OUTPUT_ARGS = ["-vn", "-b:a", "320k", "-f", "mp3"]
+MP3_COPY_OUTPUT_ARGS = ["-vn", "-c:a", "copy", "-f", "mp3"]
+
+# Can't be demuxed from a pipe, their index is at the end of the file.
+NON_STREAMABLE_CONTAINERS = {"3gp", "m4a", "mov", "mp4"}
+
+PROGRESS_KEYS = {
+    "bitrate",
+    "drop_frames",
+    "dup_frames",
+    "fps",
+    "frame",
+    "out_time",
+    "out_time_ms",
+    "out_time_us",
+    "progress",
+    "speed",
+    "total_size",
+}
+
+
+class AudioProbe(BaseModel):
+    container: str | None = None
+    codec: str | None = None
+    bitrate: int | None = None
+    duration: float | None = None
+
+    @property
+    def is_streamable(self):
+        return not NON_STREAMABLE_CONTAINERS.intersection(
+            (self.container or "").split(",")
+        )
+
+
+class TranscodeDecision(BaseModel):
+    action: Literal["copy", "encode"]
+    output_args: list[str]
+
+
+def get_transcode_decision(probe: AudioProbe):
+    if probe.codec == "mp3":
+        return TranscodeDecision(action="copy", output_args=MP3_COPY_OUTPUT_ARGS)
+    return TranscodeDecision(action="encode", output_args=MP3_OUTPUT_ARGS)
+
+
+class TranscodeProgress(BaseModel):
+    out_time: float | None = None
+    total_size: int | None = None
+    speed: float | None = None
+
+
+def _parse_progress_value(value: str | None, suffix: str = ""):
+    if value is None:
+        return None
+    try:
+        return float(value.strip().removesuffix(suffix))
+    except ValueError:
+        return None
+
+
+def _parse_progress(values: dict[str, str]):
+    out_time_us = _parse_progress_value(values.get("out_time_us"))
+    total_size = _parse_progress_value(values.get("total_size"))
+    return TranscodeProgress(
+        out_time=out_time_us / 1_000_000 if out_time_us is not None else None,
+        total_size=int(total_size) if total_size is not None else None,
+        speed=_parse_progress_value(values.get("speed"), suffix="x"),
+    )
+
+
+class FFmpegError(Exception):
+    pass
+
+
+class TranscodeSchedulerStats(BaseModel):
+    slots: int
+    threads: int
+    queued: int
+    waits: int
+    total_wait_time: float
+    max_wait_time: float
+
+
+class TranscodeScheduler:
+    # Slots are lock files shared by the worker processes of the host, served
+    # in ticket order. An unlocked ticket was left by a dead process.
+    def __init__(
+        self,
+        slots: int,
+        threads: int,
+        lock_directory: Path,
+        poll_interval: float = 0.1,
+    ):
+        self.slots = slots
+        self.threads = threads
+        self.lock_directory = lock_directory
+        self.tickets_directory = lock_directory.joinpath("tickets")
+        self.poll_interval = poll_interval
+        self.waits = 0
+        self.total_wait_time = 0.0
+        self.max_wait_time = 0.0
+
+    @contextmanager
+    def _lock_tickets(self):
+        self.tickets_directory.mkdir(parents=True, exist_ok=True)
+        fd = os.open(
+            self.lock_directory.joinpath("tickets.lock"), os.O_CREAT | os.O_RDWR
+        )
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield fd
+        finally:
+            os.close(fd)
+
+    def _take_ticket(self):
+        with self._lock_tickets() as counter:
+            number = int(os.pread(counter, 32, 0) or 0)
+            os.ftruncate(counter, 0)
+            os.pwrite(counter, str(number + 1).encode(), 0)
+            path = self.tickets_directory.joinpath(f"{number:020d}")
+            fd = os.open(path, os.O_CREAT | os.O_RDWR)
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return path, fd
+
+    def _is_first(self, ticket: Path):
+        with self._lock_tickets():
+            for path in sorted(self.tickets_directory.iterdir()):
+                if path >= ticket:
+                    return True
+                try:
+                    fd = os.open(path, os.O_RDWR)
+                except FileNotFoundError:
+                    continue
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    return False
+                finally:
+                    os.close(fd)
+                path.unlink(missing_ok=True)
+        return True
+
+    def _try_acquire(self):
+        self.lock_directory.mkdir(parents=True, exist_ok=True)
+        for index in range(self.slots):
+            fd = os.open(self.lock_directory.joinpath(f"{index}.lock"), os.O_CREAT)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return fd
+            except BlockingIOError:
+                os.close(fd)
+        return None
+
+    def _release_ticket(self, ticket: tuple[Path, int]):
+        path, fd = ticket
+        path.unlink(missing_ok=True)
+        os.close(fd)
+
+    def _release_slot(self, fd: int):
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+    async def _to_thread(self, func: Callable, release: Callable | None, *args):
+        # A cancelled call still finishes, whatever it took is given back.
+        future = asyncio.ensure_future(asyncio.to_thread(func, *args))
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+
+            def _release(future: asyncio.Future):
+                if not future.exception() and (result := future.result()) is not None:
+                    release(result)
+
+            if release:
+                future.add_done_callback(_release)
+            raise
+
+    @asynccontextmanager
+    async def slot(self):
+        start = time.monotonic()
+        ticket = await self._to_thread(self._take_ticket, self._release_ticket)
+        try:
+            while (
+                not await self._to_thread(self._is_first, None, ticket[0])
+                or (fd := await self._to_thread(self._try_acquire, self._release_slot))
+                is None
+            ):
+                await asyncio.sleep(self.poll_interval)
+        finally:
+            self._release_ticket(ticket)
+        wait_time = time.monotonic() - start
+        self.waits += 1
+        self.total_wait_time += wait_time
+        self.max_wait_time = max(self.max_wait_time, wait_time)
+        logger.info(f"Acquired transcode slot after {wait_time:.3f}s")
+        try:
+            yield self.threads
+        finally:
+            self._release_slot(fd)
+
+    def get_stats(self):
+        return TranscodeSchedulerStats(
+            slots=self.slots,
+            threads=self.threads,
+            queued=len(list(self.tickets_directory.glob("*"))),
+            waits=self.waits,
+            total_wait_time=self.total_wait_time,
+            max_wait_time=self.max_wait_time,
+        )
+
+
+scheduler = TranscodeScheduler(
+    slots=settings.ffmpeg_slots
+    or max(1, (os.cpu_count() or 1) // settings.ffmpeg_threads_per_slot),
+    threads=settings.ffmpeg_threads_per_slot,
+    lock_directory=Path(tempfile.gettempdir()).joinpath("ffmpeg-slots"),
+)
+
+
+async def _feed(stdin: asyncio.StreamWriter, source: AsyncIterable[bytes]):
+    try:
+        async for chunk in source:
+            stdin.write(chunk)
+            await stdin.drain()
+    except (BrokenPipeError, ConnectionResetError):
+        pass
+    finally:
+        stdin.close()
+
+
+async def _write_output(read: Callable[[int], Awaitable[bytes]], path: str | Path):
+    async with aiofiles.open(path, mode="wb") as f:
+        while data := await read(1024 * 1024):
+            await f.write(data)
+
+
+async def _drain(
+    stream: asyncio.StreamReader,
+    lines: deque[str],
+    on_progress: Callable[[TranscodeProgress], None] | None = None,
+):
+    progress = {}
+    async for line in stream:
+        line = line.decode(errors="replace").rstrip()
+        key, _, value = line.partition("=")
+        if on_progress and key in PROGRESS_KEYS:
+            progress[key] = value
+            if key == "progress":
+                on_progress(_parse_progress(progress))
+                progress = {}
+            continue
+        lines.append(line)
+
+
+async def transcode(
+    source: str | Path | AsyncIterable[bytes],
+    output: str | Path | Callable[[Callable[[int], Awaitable[bytes]]], Awaitable[T]],
+    output_args: list[str] = MP3_OUTPUT_ARGS,
+    tags: dict[str, str] | None = None,
+    artwork: bytes | None = None,
+    artwork_mime_type: str | None = None,
+    on_progress: Callable[[TranscodeProgress], None] | None = None,
+    use_slot: bool = True,
+) -> T | None:
+    is_piped_input = not isinstance(source, (str, Path))
+    is_piped_output = callable(output)
+    header = b""
+    if tags or artwork:
+        # ffmpeg can't finish an ID3 tag with a picture on a pipe, it is sent
+        # ahead of the stream instead.
+        if not is_piped_output:
+            output = partial(_write_output, path=output)
+            is_piped_output = True
+        audio_tags = audiotags.AudioTags()
+        audio_tags.apply(
+            **(tags or {}), artwork_data=artwork, artwork_mime_type=artwork_mime_type
+        )
+        header = await asyncio.to_thread(audio_tags.to_bytes)
+        output_args = ["-id3v2_version", "0", *output_args]
+
+    async with scheduler.slot() if use_slot else nullcontext(1) as threads:
+        process = await asyncio.create_subprocess_exec(
+            "ffmpeg",
+            "-hide_banner",
+            "-nostats",
+            *(["-progress", "pipe:2"] if on_progress else []),
+            "-y",
+            "-i",
+            "pipe:0" if is_piped_input else str(source),
+            "-threads",
+            str(threads),
+            *output_args,
+            "pipe:1" if is_piped_output else str(output),
+            stdin=asyncio.subprocess.PIPE
+            if is_piped_input
+            else asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE
+            if is_piped_output
+            else asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        stderr_lines = deque(maxlen=20)
+
+        async def _wait():
+            await stderr_task
+            await process.wait()
+            if process.returncode != 0:
+                raise FFmpegError("\n".join(stderr_lines))
+
+        async def _read(size: int):
+            nonlocal header
+            if header:
+                data, header = header[:size], header[size:]
+                return data
+            data = await process.stdout.read(size)
+            if not data:
+                await _wait()
+            return data
+
+        try:
+            async with asyncio.TaskGroup() as task_group:
+                stderr_task = task_group.create_task(
+                    _drain(process.stderr, stderr_lines, on_progress)
+                )
+                if is_piped_input:
+                    task_group.create_task(_feed(process.stdin, source))
+                result = await output(_read) if is_piped_output else None
+                await _wait()
+            return result
+        except BaseException as e:
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+            if isinstance(e, BaseExceptionGroup):
+                raise e.exceptions[0]
+            raise
+
+
+async def probe(source: str | Path):
+    process = await asyncio.create_subprocess_exec(
+        "ffprobe",
+        "-v",
+        "error",
+        "-select_streams",
+        "a:0",
+        "-show_entries",
+        "stream=codec_name,bit_rate:format=format_name,bit_rate,duration",
+        "-of",
+        "json",
+        str(source),
+        stdin=asyncio.subprocess.DEVNULL,
         stdout=asyncio.subprocess.PIPE,
         stderr=asyncio.subprocess.PIPE,
     )
-    error = await process.stderr.read()
-    await process.wait()
+    stdout, stderr = await process.communicate()
     if process.returncode != 0:
-        raise Exception(error.decode())
-    return output_filename
+        raise FFmpegError(stderr.decode(errors="replace"))
+    info = json.loads(stdout)
+    stream = next(iter(info.get("streams", [])), {})
+    container = info.get("format", {})
+    bitrate = stream.get("bit_rate") or container.get("bit_rate")
+    duration = container.get("duration")
+    return AudioProbe(
+        container=container.get("format_name"),
+        codec=stream.get("codec_name"),
+        bitrate=int(bitrate) if bitrate else None,
+        duration=float(duration) if duration else None,
+    )
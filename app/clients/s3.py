@@ -1,11 +1,19 @@
 import asyncio
+import logging
+from functools import partial
+from typing import AsyncIterable, Awaitable, Callable
 from urllib.parse import urljoin, urlparse, urlunparse
 
+import aiofiles
+import aiofiles.os
 import boto3
 from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError
 
 from app.settings import settings
 
+logger = logging.getLogger(__name__)
+
 _client = boto3.client(
     "s3",
     endpoint_url=settings.aws_endpoint_url,
@@ -40,12 +48,211 @@ async def upload_file(
     )
 
 
+async def _read_chunk(read: Callable[[int], Awaitable[bytes]], size: int):
+    # Stream readers may return short reads before EOF, but every multipart
+    # part other than the last one has to be at least 5MB.
+    chunk = bytearray()
+    while len(chunk) < size:
+        data = await read(size - len(chunk))
+        if not data:
+            break
+        chunk.extend(data)
+    return bytes(chunk)
+
+
+async def _read_file_part(path: str, offset: int, size: int):
+    async with aiofiles.open(path, mode="rb") as f:
+        await f.seek(offset)
+        return await f.read(size)
+
+
+async def _upload_parts(
+    filename: str,
+    parts: AsyncIterable[bytes | Callable[[], Awaitable[bytes]]],
+    content_type: str,
+    acl: str,
+    concurrency: int,
+    max_retries: int,
+):
+    response = await asyncio.to_thread(
+        _client.create_multipart_upload,
+        Bucket=settings.aws_s3_bucket,
+        Key=filename,
+        ACL=acl,
+        ContentType=content_type,
+    )
+    upload_id = response["UploadId"]
+    semaphore = asyncio.Semaphore(concurrency)
+    completed_parts = []
+
+    async def _upload_part(
+        part_number: int, part: bytes | Callable[[], Awaitable[bytes]]
+    ):
+        try:
+            body = part if isinstance(part, bytes) else await part()
+            attempt = 0
+            while True:
+                try:
+                    response = await asyncio.to_thread(
+                        _client.upload_part,
+                        Bucket=settings.aws_s3_bucket,
+                        Key=filename,
+                        UploadId=upload_id,
+                        PartNumber=part_number,
+                        Body=body,
+                    )
+                    break
+                except (BotoCoreError, ClientError):
+                    attempt += 1
+                    if attempt > max_retries:
+                        raise
+                    logger.warning(
+                        f"Retrying part {part_number} of {filename} "
+                        f"({attempt}/{max_retries})"
+                    )
+                    await asyncio.sleep(2 ** (attempt - 1))
+            completed_parts.append(
+                {"ETag": response["ETag"], "PartNumber": part_number}
+            )
+        finally:
+            semaphore.release()
+
+    try:
+        async with asyncio.TaskGroup() as task_group:
+            part_number = 0
+            async for part in parts:
+                await semaphore.acquire()
+                part_number += 1
+                task_group.create_task(_upload_part(part_number, part))
+    except BaseException as e:
+        await asyncio.to_thread(
+            _client.abort_multipart_upload,
+            Bucket=settings.aws_s3_bucket,
+            Key=filename,
+            UploadId=upload_id,
+        )
+        if isinstance(e, BaseExceptionGroup):
+            raise e.exceptions[0]
+        raise
+
+    return await asyncio.to_thread(
+        _client.complete_multipart_upload,
+        Bucket=settings.aws_s3_bucket,
+        Key=filename,
+        UploadId=upload_id,
+        MultipartUpload={
+            "Parts": sorted(completed_parts, key=lambda part: part["PartNumber"])
+        },
+    )
+
+
+async def upload_stream(
+    filename: str,
+    read: Callable[[int], Awaitable[bytes]],
+    content_type: str,
+    acl="public-read",
+    chunk_size: int = settings.aws_s3_multipart_chunk_size,
+    concurrency: int = settings.aws_s3_multipart_concurrency,
+    max_retries: int = settings.aws_s3_multipart_max_retries,
+):
+    chunk = await _read_chunk(read, chunk_size)
+    if len(chunk) < chunk_size:
+        return await upload_file(
+            filename=filename, body=chunk, content_type=content_type, acl=acl
+        )
+
+    async def _iter_parts(chunk: bytes):
+        while chunk:
+            yield chunk
+            chunk = await _read_chunk(read, chunk_size)
+
+    return await _upload_parts(
+        filename=filename,
+        parts=_iter_parts(chunk),
+        content_type=content_type,
+        acl=acl,
+        concurrency=concurrency,
+        max_retries=max_retries,
+    )
+
+
+async def upload_path(
+    filename: str,
+    path: str,
+    content_type: str,
+    acl="public-read",
+    chunk_size: int = settings.aws_s3_multipart_chunk_size,
+    concurrency: int = settings.aws_s3_multipart_concurrency,
+    max_retries: int = settings.aws_s3_multipart_max_retries,
+):
+    size = await aiofiles.os.path.getsize(path)
+    if size <= chunk_size:
+        return await upload_file(
+            filename=filename,
+            body=await _read_file_part(path=path, offset=0, size=size),
+            content_type=content_type,
+            acl=acl,
+        )
+
+    # Parts are read from disk by the task uploading them, so at most
+    # `concurrency` parts are held in memory regardless of the file size.
+    async def _iter_parts():
+        for offset in range(0, size, chunk_size):
+            yield partial(_read_file_part, path=path, offset=offset, size=chunk_size)
+
+    return await _upload_parts(
+        filename=filename,
+        parts=_iter_parts(),
+        content_type=content_type,
+        acl=acl,
+        concurrency=concurrency,
+        max_retries=max_retries,
+    )
+
+
+async def file_exists(filename: str):
+    try:
+        await asyncio.to_thread(
+            _client.head_object, Bucket=settings.aws_s3_bucket, Key=filename
+        )
+        return True
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey"):
+            return False
+        raise
+
+
+async def copy_file(source_filename: str, filename: str, acl="public-read"):
+    return await asyncio.to_thread(
+        _client.copy_object,
+        Bucket=settings.aws_s3_bucket,
+        Key=filename,
+        CopySource={"Bucket": settings.aws_s3_bucket, "Key": source_filename},
+        ACL=acl,
+    )
+
+
 async def delete_file(filename: str):
     return await asyncio.to_thread(
         _client.delete_object, Bucket=settings.aws_s3_bucket, Key=filename
     )
 
 
+async def delete_files(filenames: list[str]):
+    # DeleteObjects takes up to 1000 keys per request.
+    for i in range(0, len(filenames), 1000):
+        response = await asyncio.to_thread(
+            _client.delete_objects,
+            Bucket=settings.aws_s3_bucket,
+            Delete={
+                "Objects": [{"Key": filename} for filename in filenames[i : i + 1000]],
+                "Quiet": True,
+            },
+        )
+        if errors := response.get("Errors"):
+            raise Exception(f"Failed to delete {len(errors)} files: {errors[0]}")
+
+
 async def list_filenames(prefix: str = ""):
     continuation_token = ""
     while True:
@@ -1,31 +1,149 @@
 import asyncio
+import hashlib
+import json
+import logging
+import threading
+import zlib
+from typing import Callable
 
 import yt_dlp
+from redis.asyncio import Redis
 
+from app.settings import settings
+from app.utils.youtube import get_video_key
 
-async def download_audio_from_video(download_path: str, url: str):
+logger = logging.getLogger(__name__)
+
+
+def _get_info_cache_key(url: str):
+    video_key = get_video_key(url)
+    return f"ytdlp:info:{hashlib.sha256(video_key.encode()).hexdigest()}"
+
+
+async def _get_cached_video_info(url: str, redis: Redis | None):
+    if redis is None:
+        return None
+    if data := await redis.get(_get_info_cache_key(url)):
+        try:
+            return await asyncio.to_thread(lambda: json.loads(zlib.decompress(data)))
+        except (zlib.error, ValueError):
+            logger.warning(f"Cached info for {url} is corrupt, extracting again")
+    return None
+
+
+async def _cache_video_info(url: str, data: bytes, redis: Redis | None):
+    if redis is None:
+        return
+    if len(data) > settings.ytdlp_info_cache_max_size:
+        logger.info(f"Skipping info cache for {url}, {len(data)} bytes is too large")
+        return
+    await redis.set(_get_info_cache_key(url), data, ex=settings.ytdlp_info_cache_ttl)
+
+
+def _serialize_video_info(ydl: yt_dlp.YoutubeDL, info: dict):
+    return zlib.compress(json.dumps(ydl.sanitize_info(info)).encode())
+
+
+async def download_audio_from_video(
+    download_path: str,
+    url: str,
+    redis: Redis | None = None,
+    progress_hook: Callable[[dict], None] | None = None,
+):
+    cached_info = await _get_cached_video_info(url=url, redis=redis)
+
+    # Audio extraction is left to the caller so that ffmpeg runs under the
+    # transcode scheduler instead of inside yt-dlp's postprocessor.
     def _download_audio_from_video():
         ydl_opts = {
-            "format": "best",
+            # Prefer audio-only formats so the video stream isn't downloaded.
+            "format": "bestaudio/best",
             "fixup": "never",
-            "postprocessors": [
-                {
-                    "key": "FFmpegExtractAudio",
-                    "preferredcodec": "mp3",
-                    "preferredquality": "0",
-                }
-            ],
-            "outtmpl": download_path,
+            "outtmpl": f"{download_path}.%(ext)s",
+            # Hooks are called from the download thread.
+            "progress_hooks": [progress_hook] if progress_hook else [],
         }
         with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            ydl.download(url)
+            if cached_info:
+                try:
+                    # Skips extraction, formats are selected again from the
+                    # cached info with these options.
+                    info = ydl.process_ie_result(cached_info, download=True)
+                    return ydl.prepare_filename(info)
+                except yt_dlp.utils.DownloadError:
+                    logger.warning(f"Cached info for {url} is stale, extracting again")
+            info = ydl.extract_info(url, download=True)
+            return ydl.prepare_filename(info)
 
     return await asyncio.to_thread(_download_audio_from_video)
 
 
-async def extract_video_info(url: str):
+async def extract_video_info(url: str, redis: Redis | None = None):
+    if cached_info := await _get_cached_video_info(url=url, redis=redis):
+        return cached_info
+
     def _extract_video_info():
         with yt_dlp.YoutubeDL() as ydl:
-            return ydl.extract_info(url, download=False)
+            info = ydl.extract_info(url, download=False)
+            return info, _serialize_video_info(ydl=ydl, info=info)
+
+    info, data = await asyncio.to_thread(_extract_video_info)
+    await _cache_video_info(url=url, data=data, redis=redis)
+    return info
+
+
+async def iter_playlist_entries(url: str, max_buffered_entries: int = 100):
+    # Yields (playlist, entry) pairs while yt-dlp is still paging through the
+    # playlist. Entries are flat, only the playlist pages are requested.
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(maxsize=max_buffered_entries)
+    stopped = threading.Event()
+    done = object()
+
+    def _put(item):
+        asyncio.run_coroutine_threadsafe(queue.put(item), loop).result()
+
+    def _iter_playlist_entries():
+        try:
+            ydl_opts = {"extract_flat": "in_playlist", "lazy_playlist": True}
+            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+                # Processing would resolve every page before returning, the
+                # raw result keeps its entries lazy.
+                info = ydl.extract_info(url, download=False, process=False)
+                while info.get("_type") in ("url", "url_transparent"):
+                    info = ydl.extract_info(
+                        info["url"],
+                        download=False,
+                        process=False,
+                        ie_key=info.get("ie_key"),
+                    )
+                if info.get("_type") != "playlist":
+                    raise Exception(f"{url} is not a playlist")
+                playlist = {
+                    key: value for key, value in info.items() if key != "entries"
+                }
+                for entry in info.get("entries") or []:
+                    if stopped.is_set():
+                        return
+                    # Unavailable videos come through as None, nested playlists
+                    # such as channel tabs aren't expanded.
+                    if entry and entry.get("_type") != "playlist":
+                        _put((playlist, entry))
+        except Exception as e:
+            if not stopped.is_set():
+                _put(e)
+            return
+        if not stopped.is_set():
+            _put(done)
 
-    return await asyncio.to_thread(_extract_video_info)
+    loop.run_in_executor(None, _iter_playlist_entries)
+    try:
+        while (item := await queue.get()) is not done:
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stopped.set()
+        # Unblocks the extraction thread if it is waiting on a full queue.
+        while not queue.empty():
+            queue.get_nowait()
@@ -1,4 +1,5 @@
 import base64
+import hashlib
 from datetime import datetime
 
 import httpx
@@ -14,6 +15,56 @@ from app.db.models.users import User
 from app.settings import settings
 
 
+def _parse_artwork_data(artwork_url: str):
+    base64_data = None
+    if artwork_url.startswith(("/9j", "iVBORw0KGgo")):
+        base64_data = artwork_url
+    elif (parts := artwork_url.split("base64,")) and len(parts) == 2:
+        base64_data = parts[-1]
+
+    if base64_data:
+        extension = artwork_url.split(":")[0].split("/")[1]
+        data_string = ",".join(artwork_url.split(",")[1:])
+        return base64.b64decode(data_string.encode()), extension
+    return None
+
+
+async def resolve_shared_artwork_url(artwork_url: str):
+    # Artwork shared by many jobs is stored once under its content hash and
+    # isn't owned by any of them.
+    if artwork := _parse_artwork_data(artwork_url=artwork_url):
+        data, extension = artwork
+        digest = hashlib.sha256(data).hexdigest()
+        filename = f"{settings.aws_s3_artwork_folder}/shared/{digest}.{extension}"
+        if not await s3.file_exists(filename=filename):
+            await s3.upload_file(
+                filename=filename, body=data, content_type=f"image/{extension}"
+            )
+        return s3.resolve_url(filename=filename)
+    async with httpx.AsyncClient() as client:
+        response = await client.get(artwork_url)
+        if response.is_success and imagedownloader.is_image_link(response):
+            return artwork_url
+    return None
+
+
+class MusicJobStage:
+    UPLOADED = "uploaded"
+    FETCHED = "fetched"
+    TRANSCODED = "transcoded"
+    TAGGED = "tagged"
+    STORED = "stored"
+
+
+MUSIC_JOB_STAGES = [
+    MusicJobStage.UPLOADED,
+    MusicJobStage.FETCHED,
+    MusicJobStage.TRANSCODED,
+    MusicJobStage.TAGGED,
+    MusicJobStage.STORED,
+]
+
+
 class MusicJob(base.UUIDAuditBase):
     __tablename__ = "music_jobs"
 
@@ -31,13 +82,27 @@ class MusicJob(base.UUIDAuditBase):
     artist: Mapped[str] = mapped_column(nullable=False)
     album: Mapped[str] = mapped_column(nullable=False)
     grouping: Mapped[str | None] = mapped_column(nullable=True)
+    source_container: Mapped[str | None] = mapped_column(nullable=True)
+    source_codec: Mapped[str | None] = mapped_column(nullable=True)
+    source_bitrate: Mapped[int | None] = mapped_column(nullable=True)
+    transcode_action: Mapped[str | None] = mapped_column(nullable=True)
+    stage: Mapped[str | None] = mapped_column(nullable=True)
+    source_filename: Mapped[str | None] = mapped_column(nullable=True)
+    audio_filename: Mapped[str | None] = mapped_column(nullable=True)
+    tagged_filename: Mapped[str | None] = mapped_column(nullable=True)
     completed: Mapped[datetime | None] = mapped_column(nullable=True)
     failed: Mapped[datetime | None] = mapped_column(nullable=True)
+    error: Mapped[str | None] = mapped_column(nullable=True)
     deleted_at: Mapped[datetime | None] = mapped_column(
         TIMESTAMP(timezone=True), nullable=True
     )
     user: Mapped[User] = relationship(back_populates="jobs", uselist=True)
 
+    def reached_stage(self, stage: str):
+        return self.stage is not None and MUSIC_JOB_STAGES.index(
+            self.stage
+        ) >= MUSIC_JOB_STAGES.index(stage)
+
     async def cleanup(self):
         if self.artwork_filename:
             await s3.delete_file(filename=self.artwork_filename)
@@ -49,23 +114,15 @@ class MusicJob(base.UUIDAuditBase):
     async def _upload_audio_file(self, file: UploadFile):
         filename = f"{settings.aws_s3_music_folder}/{self.id}/old/{file.filename}"
         url = s3.resolve_url(filename=filename)
-        await s3.upload_file(
-            filename=filename, body=await file.read(), content_type=file.content_type
+        await s3.upload_stream(
+            filename=filename, read=file.read, content_type=file.content_type
         )
         self.original_filename = filename
         self.filename_url = url
 
     async def _upload_artwork_url(self, artwork_url: str):
-        base64_data = None
-        if artwork_url.startswith(("/9j", "iVBORw0KGgo")):
-            base64_data = artwork_url
-        elif (parts := artwork_url.split("base64,")) and len(parts) == 2:
-            base64_data = parts[-1]
-
-        if base64_data:
-            extension = artwork_url.split(":")[0].split("/")[1]
-            data_string = ",".join(artwork_url.split(",")[1:])
-            data = base64.b64decode(data_string.encode())
+        if artwork := _parse_artwork_data(artwork_url=artwork_url):
+            data, extension = artwork
             filename = f"{settings.aws_s3_artwork_folder}/{self.id}/artwork.{extension}"
             url = s3.resolve_url(filename=filename)
             await s3.upload_file(
@@ -87,6 +144,7 @@ class MusicJob(base.UUIDAuditBase):
                 await self._upload_audio_file(file=file)
             if artwork_url:
                 await self._upload_artwork_url(artwork_url=artwork_url)
+            self.stage = MusicJobStage.UPLOADED
             music_job_repo = await provide_music_jobs_repo(db_session=db_session)
             await music_job_repo.update(self)
 
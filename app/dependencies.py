@@ -1,11 +1,5 @@
-from redis.asyncio import Redis
-
-from app.settings import settings
+from app.services import redispool
 
 
 async def provide_redis():
-    redis_client = Redis.from_url(settings.redis_url)
-    try:
-        yield redis_client
-    except Exception:
-        await redis_client.aclose()
+    return redispool.get_client()
@@ -1,9 +1,10 @@
 from typing import Literal, Optional
 
 from litestar.datastructures import UploadFile
-from pydantic import BaseModel, ConfigDict, HttpUrl
+from pydantic import BaseModel, ConfigDict, Field, HttpUrl, model_validator
 
 from app.models import Response
+from app.settings import settings
 
 
 class GroupingResponse(Response):
@@ -16,7 +17,12 @@ class ResolvedArtworkResponse(Response):
 
 class MusicJobUpdateResponse(Response):
     id: str
-    status: Literal["STARTED", "COMPLETED"]
+    status: Literal["STARTED", "PROGRESS", "COMPLETED", "FAILED"]
+    stage: Optional[str] = None
+    progress: Optional[float] = None
+    processed_bytes: Optional[int] = None
+    eta: Optional[float] = None
+    error: Optional[str] = None
 
 
 class TagsResponse(Response):
@@ -37,3 +43,43 @@ class CreateMusicJob(BaseModel):
     artist: str
     album: str
     grouping: Optional[str] = None
+
+
+class CreateMusicJobsEntry(BaseModel):
+    video_url: HttpUrl
+    artwork_url: Optional[str] = None
+    title: str
+    artist: Optional[str] = None
+    album: Optional[str] = None
+    grouping: Optional[str] = None
+
+
+class CreateMusicJobs(BaseModel):
+    # Values shared by every job, e.g. the tracks of one album.
+    artwork_url: Optional[str] = None
+    artist: Optional[str] = None
+    album: Optional[str] = None
+    grouping: Optional[str] = None
+    jobs: list[CreateMusicJobsEntry] = Field(
+        ..., min_length=1, max_length=settings.music_job_bulk_max_size
+    )
+
+    @model_validator(mode="after")
+    def check_jobs(self):
+        for job in self.jobs:
+            if not (job.artist or self.artist) or not (job.album or self.album):
+                raise ValueError("'artist' and 'album' must be defined for every job.")
+        return self
+
+
+class CreatedMusicJobsResponse(Response):
+    ids: list[str]
+
+
+class CreateMusicPlaylistJobs(BaseModel):
+    # Values missing here are taken from the playlist.
+    playlist_url: HttpUrl
+    artwork_url: Optional[str] = None
+    artist: Optional[str] = None
+    album: Optional[str] = None
+    grouping: Optional[str] = None
@@ -1,9 +1,25 @@
 import asyncio
+import hashlib
+import logging
+import re
+import time
+from collections import deque
 from contextlib import asynccontextmanager
+from typing import Callable
 
-from redis.asyncio import Redis
+from redis.asyncio.client import PubSub as RedisPubSub
 
-from app.settings import settings
+from app.models import Response
+from app.services import redispool
+from app.settings import OverflowPolicy, settings
+
+logger = logging.getLogger(__name__)
+
+LOG_ID_PATTERN = re.compile(r"^\d+(-\d+)?$")
+
+
+def parse_log_id(log_id: str):
+    return tuple(int(part) for part in log_id.split("-"))
 
 
 class PubSub:
@@ -11,47 +27,383 @@ class PubSub:
         MUSIC_JOB_UPDATE = "MUSIC_JOB_UPDATE"
         YOUTUBE_CHANNEL_UPDATE = "YOUTUBE_CHANNEL_UPDATE"
 
-    def __init__(self, channels: list[str]):
-        self.channels = channels
+    def __init__(
+        self,
+        channels: list[str] | None = None,
+        patterns: list[str] | None = None,
+        log_max_length: int | None = None,
+    ):
+        self.channels = channels or []
+        self.patterns = patterns or []
+        self.log_max_length = log_max_length
+
+    @staticmethod
+    def get_user_channel(channel: str, user_email: str):
+        return f"{channel}:{hashlib.sha256(user_email.encode()).hexdigest()}"
+
+    @staticmethod
+    def get_log_key(channel: str):
+        return f"log:{channel}"
 
     @asynccontextmanager
     async def _get_redis(self):
-        redis = Redis.from_url(settings.redis_url)
-        try:
-            yield redis
-        finally:
-            await redis.aclose()
+        yield redispool.get_client()
 
     async def listen(self, ignore_subscribe_messages=False, timeout=60):
         async with self._get_redis() as redis:
             pubsub = redis.pubsub()
-            await pubsub.subscribe(*self.channels)
-            self._listen = True
-            while self._listen:
-                message = await pubsub.get_message(
-                    ignore_subscribe_messages=False, timeout=timeout
-                )
-                if (
-                    ignore_subscribe_messages
-                    and message
-                    and message["type"] == "subscribe"
-                ):
-                    continue
-                yield message
-            await pubsub.unsubscribe()
+            try:
+                if self.channels:
+                    await pubsub.subscribe(*self.channels)
+                if self.patterns:
+                    await pubsub.psubscribe(*self.patterns)
+                self._listen = True
+                while self._listen:
+                    message = await pubsub.get_message(
+                        ignore_subscribe_messages=False, timeout=timeout
+                    )
+                    if (
+                        ignore_subscribe_messages
+                        and message
+                        and message["type"] in ("subscribe", "psubscribe")
+                    ):
+                        continue
+                    yield message
+                await pubsub.unsubscribe()
+                await pubsub.punsubscribe()
+            finally:
+                await pubsub.aclose()
 
     def stop_listening(self):
         self._listen = False
 
-    async def publish_message(self, message: str):
+    async def publish_message(self, message: str, log: bool = True):
+        await self.publish_many([message], log=log)
+
+    async def publish_many(self, messages: list[str], log: bool = True):
+        log = log and bool(self.log_max_length)
+        async with self._get_redis() as redis:
+            async with redis.pipeline(transaction=False) as pipe:
+                for message in messages:
+                    encoded_message = message.encode()
+                    for channel in self.channels:
+                        # Logged first, a woken listener finds it in the log.
+                        if log:
+                            pipe.xadd(
+                                self.get_log_key(channel),
+                                {"data": encoded_message},
+                                maxlen=self.log_max_length,
+                                approximate=True,
+                            )
+                        pipe.publish(channel=channel, message=encoded_message)
+                if log:
+                    for channel in self.channels:
+                        pipe.expire(self.get_log_key(channel), settings.pubsub_log_ttl)
+                await pipe.execute()
+
+    async def read_log(self, channel: str, after: str = "-", count: int | None = None):
         async with self._get_redis() as redis:
-            encoded_message = message.encode()
-            await asyncio.gather(
-                *[
-                    redis.publish(channel=channel, message=encoded_message)
-                    for channel in self.channels
-                ]
+            entries = await redis.xrange(
+                self.get_log_key(channel),
+                min=f"({after}" if after != "-" else after,
+                count=count,
             )
+        return [
+            (entry_id.decode(), fields[b"data"].decode())
+            for entry_id, fields in entries
+        ]
+
+    async def is_log_trimmed(self, channel: str, after: str):
+        async with self._get_redis() as redis:
+            entries = await redis.xrange(self.get_log_key(channel), count=1)
+        return not entries or parse_log_id(entries[0][0].decode()) > parse_log_id(after)
+
+    async def get_log_position(self, channel: str):
+        async with self._get_redis() as redis:
+            entries = await redis.xrevrange(self.get_log_key(channel), count=1)
+        return entries[0][0].decode() if entries else "0-0"
 
     async def close(self):
         await self.close()
+
+
+class SubscriptionOverflowError(Exception):
+    pass
+
+
+class PubSubSubscription:
+    # A subscription whose log was trimmed past its last id is `reset`, the
+    # subscriber has to refetch the state it missed.
+    def __init__(
+        self,
+        max_size: int,
+        overflow_policy: OverflowPolicy = OverflowPolicy.DROP_OLDEST,
+        coalesce_key: Callable[[str], str | None] | None = None,
+        last_id: str | None = None,
+    ):
+        self.max_size = max_size
+        self.overflow_policy = OverflowPolicy(overflow_policy)
+        self.coalesce_key = coalesce_key
+        self.last_id = last_id
+        self.reset = False
+        self.backlog: deque[tuple[str | None, str]] = deque()
+        self.entries: deque[tuple[str | None, str, str | None]] = deque()
+        self.dropped = 0
+        self.coalesced = 0
+        self.overflowed = False
+        self._event = asyncio.Event()
+
+    def _get_coalesce_key(self, data: str):
+        try:
+            return self.coalesce_key(data)
+        except Exception:
+            logger.exception("Failed to get the coalesce key of a message")
+            return None
+
+    def _coalesce(self, key: str | None):
+        if key is None:
+            return False
+        for index, (_, _, queued_key) in enumerate(self.entries):
+            if queued_key == key:
+                del self.entries[index]
+                self.coalesced += 1
+                return True
+        return False
+
+    def put(self, entry: tuple[str | None, str]):
+        if self.overflowed:
+            return
+        log_id, data = entry
+        key = (
+            self._get_coalesce_key(data)
+            if self.overflow_policy == OverflowPolicy.COALESCE and self.coalesce_key
+            else None
+        )
+        if len(self.entries) >= self.max_size:
+            if self.overflow_policy == OverflowPolicy.DISCONNECT:
+                self.overflowed = True
+                self.entries.clear()
+                self._event.set()
+                return
+            if not self._coalesce(key):
+                self.entries.popleft()
+                self.dropped += 1
+        self.entries.append((log_id, data, key))
+        self._event.set()
+
+    def get_lag(self):
+        log_id = next((log_id for log_id, _, _ in self.entries if log_id), None)
+        if log_id is None:
+            return 0.0
+        return max(time.time() - parse_log_id(log_id)[0] / 1000, 0.0)
+
+    async def get(self):
+        while True:
+            if self.backlog:
+                log_id, data = self.backlog.popleft()
+            else:
+                while not self.entries and not self.overflowed:
+                    self._event.clear()
+                    await self._event.wait()
+                if self.overflowed:
+                    raise SubscriptionOverflowError(
+                        f"Subscriber fell more than {self.max_size} messages behind"
+                    )
+                log_id, data, _ = self.entries.popleft()
+            if log_id is None:
+                return log_id, data
+            if self.last_id is None or parse_log_id(log_id) > parse_log_id(
+                self.last_id
+            ):
+                self.last_id = log_id
+                return log_id, data
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return await self.get()
+
+
+class PubSubHubStats(Response):
+    channels: int
+    subscribers: int
+    pending: int
+    max_pending: int
+    max_lag: float
+    dropped: int
+    coalesced: int
+    disconnected: int
+
+
+class PubSubHub:
+    # One redis connection per process for every local subscriber. Channels
+    # have to be published with a log, except for `is_transient` messages.
+    def __init__(
+        self,
+        queue_size: int = settings.pubsub_subscriber_queue_size,
+        overflow_policy: OverflowPolicy = settings.pubsub_subscriber_overflow_policy,
+        coalesce_key: Callable[[str], str | None] | None = None,
+        is_transient: Callable[[str], bool] | None = None,
+        reconnect_delay: float = 1,
+    ):
+        self.pubsub = PubSub()
+        self.queue_size = queue_size
+        self.overflow_policy = OverflowPolicy(overflow_policy)
+        self.coalesce_key = coalesce_key
+        self.is_transient = is_transient
+        self.reconnect_delay = reconnect_delay
+        self._dropped = 0
+        self._coalesced = 0
+        self._disconnected = 0
+        self._subscribers: dict[str, set[PubSubSubscription]] = {}
+        self._positions: dict[str, str] = {}
+        self._lock = asyncio.Lock()
+        self._redis_pubsub: RedisPubSub | None = None
+        self._task: asyncio.Task | None = None
+
+    async def _listen(self):
+        reconnected = False
+        while self._redis_pubsub:
+            try:
+                if reconnected:
+                    for channel in list(self._positions):
+                        await self._read_log(channel)
+                    reconnected = False
+                message = await self._redis_pubsub.get_message(
+                    ignore_subscribe_messages=True, timeout=60
+                )
+                if message and message["type"] == "message":
+                    channel = message["channel"].decode()
+                    data = message["data"].decode()
+                    if self._is_transient(data):
+                        self._put(channel, [(None, data)])
+                    else:
+                        await self._read_log(channel, count=1)
+            except Exception:
+                logger.exception(f"Lost subscription to {list(self._subscribers)}")
+                reconnected = True
+                await asyncio.sleep(self.reconnect_delay)
+
+    def _is_transient(self, data: str):
+        if not self.is_transient:
+            return False
+        try:
+            return self.is_transient(data)
+        except Exception:
+            logger.exception("Failed to check whether a message is transient")
+            return False
+
+    def _put(self, channel: str, entries: list[tuple[str | None, str]]):
+        for subscription in self._subscribers.get(channel, ()):
+            for entry in entries:
+                subscription.put(entry)
+
+    async def _read_log(self, channel: str, count: int | None = None):
+        if channel not in self._positions:
+            return
+        entries = await self.pubsub.read_log(
+            channel=channel, after=self._positions[channel], count=count
+        )
+        if not entries or channel not in self._positions:
+            return
+        self._positions[channel] = entries[-1][0]
+        self._put(channel, entries)
+
+    @asynccontextmanager
+    async def subscribe(self, channel: str, last_id: str | None = None):
+        if self._redis_pubsub is None:
+            self._redis_pubsub = redispool.get_client().pubsub()
+        if last_id and not LOG_ID_PATTERN.match(last_id):
+            last_id = None
+        subscription = PubSubSubscription(
+            max_size=self.queue_size,
+            overflow_policy=self.overflow_policy,
+            coalesce_key=self.coalesce_key,
+            last_id=last_id,
+        )
+        async with self._lock:
+            if channel not in self._subscribers:
+                await self._redis_pubsub.subscribe(channel)
+                self._positions[channel] = await self.pubsub.get_log_position(
+                    channel=channel
+                )
+                self._subscribers[channel] = set()
+            self._subscribers[channel].add(subscription)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._listen())
+        try:
+            if last_id and await self.pubsub.is_log_trimmed(
+                channel=channel, after=last_id
+            ):
+                subscription.reset = True
+                subscription.last_id = None
+            elif last_id:
+                subscription.backlog.extend(
+                    await self.pubsub.read_log(channel=channel, after=last_id)
+                )
+            yield subscription
+        finally:
+            if (
+                subscription.dropped
+                or subscription.coalesced
+                or subscription.overflowed
+            ):
+                logger.warning(
+                    f"Subscriber of {channel} fell behind: dropped "
+                    f"{subscription.dropped}, coalesced {subscription.coalesced}, "
+                    f"disconnected {subscription.overflowed}"
+                )
+            self._dropped += subscription.dropped
+            self._coalesced += subscription.coalesced
+            self._disconnected += int(subscription.overflowed)
+            async with self._lock:
+                # Gone if the hub was closed while subscribed.
+                subscriptions = self._subscribers.get(channel)
+                if subscriptions is not None:
+                    subscriptions.discard(subscription)
+                    if not subscriptions:
+                        del self._subscribers[channel]
+                        del self._positions[channel]
+                        if self._redis_pubsub is not None:
+                            await self._redis_pubsub.unsubscribe(channel)
+
+    def get_stats(self):
+        subscriptions = [
+            subscription
+            for channel_subscriptions in self._subscribers.values()
+            for subscription in channel_subscriptions
+        ]
+        return PubSubHubStats(
+            channels=len(self._subscribers),
+            subscribers=len(subscriptions),
+            pending=sum(len(subscription.entries) for subscription in subscriptions),
+            max_pending=max(
+                (len(subscription.entries) for subscription in subscriptions), default=0
+            ),
+            max_lag=max(
+                (subscription.get_lag() for subscription in subscriptions), default=0.0
+            ),
+            dropped=self._dropped
+            + sum(subscription.dropped for subscription in subscriptions),
+            coalesced=self._coalesced
+            + sum(subscription.coalesced for subscription in subscriptions),
+            disconnected=self._disconnected
+            + sum(int(subscription.overflowed) for subscription in subscriptions),
+        )
+
+    async def close(self):
+        redis_pubsub, self._redis_pubsub = self._redis_pubsub, None
+        self._subscribers.clear()
+        self._positions.clear()
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if redis_pubsub:
+            if redis_pubsub.subscribed:
+                await redis_pubsub.unsubscribe()
+            await redis_pubsub.aclose()
@@ -5,6 +5,7 @@ from app.settings import settings
 celery = Celery(
     "tasks",
     broker=settings.redis_url,
+    include=["app.queue.email", "app.queue.music"],
     task_cls="app.queue.task.QueueTask",
 )
 celery.conf.update(
@@ -13,4 +14,36 @@ celery.conf.update(
     result_serializer="json",
     result_backend_always_retry=True,
     result_backend_max_retries=3,
+    # Transcoding is the only CPU-bound stage of a music job, the other stages
+    # mostly wait on the network and can run on cheaper workers. Workers have
+    # to be started with `-Q` for these queues, see the Makefile.
+    task_routes={
+        "app.queue.music.fetch_music_job": {"queue": settings.music_io_queue},
+        "app.queue.music.transcode_music_job": {
+            "queue": settings.music_transcode_queue
+        },
+        "app.queue.music.tag_music_job": {"queue": settings.music_io_queue},
+        "app.queue.music.upload_music_job": {"queue": settings.music_io_queue},
+    },
+    # Runs in the worker started with `-B`, there should only be one.
+    beat_schedule={
+        "dispatch-music-jobs": {
+            "task": "app.queue.music.dispatch_music_jobs",
+            "schedule": settings.music_scheduler_dispatch_interval,
+        },
+    },
 )
+
+if settings.worker_asyncio:
+    # Each thread only waits on a coroutine running on the process' shared
+    # event loop, so concurrency is the number of jobs in flight. Tasks are
+    # acknowledged once they finish and only one message is reserved per slot,
+    # so a busy worker leaves the rest of the queue to other workers.
+    celery.conf.update(
+        task_acks_late=True,
+        worker_pool="threads",
+        worker_prefetch_multiplier=1,
+    )
+
+if settings.worker_concurrency:
+    celery.conf.update(worker_concurrency=settings.worker_concurrency)
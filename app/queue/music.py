@@ -1,75 +1,307 @@
 import asyncio
+import hashlib
 import json
+import logging
+import shutil
+import time
+from contextlib import asynccontextmanager
 from datetime import UTC, datetime
+from functools import partial
 from pathlib import Path
 
-import aiofiles
 import aiofiles.os
 import httpx
+import yt_dlp
+from botocore.exceptions import BotoCoreError, ClientError
+from celery import chain, group
+from litestar.datastructures import UploadFile
+from redis.asyncio import Redis
+from redis.exceptions import ConnectionError as RedisConnectionError
+from redis.exceptions import LockError
+from sqlalchemy.ext.asyncio import AsyncSession
 from yt_dlp.utils import sanitize_filename
 
-from app.clients import audiotags, ffmpeg, imagedownloader, s3, ytdlp
-from app.db.models.musicjob import MusicJob, provide_music_jobs_repo
+from app.clients import downloader, ffmpeg, imagedownloader, s3, ytdlp
+from app.db import sqlalchemy_config
+from app.db.models.musicjob import (
+    MusicJob,
+    MusicJobStage,
+    provide_music_jobs_repo,
+    resolve_shared_artwork_url,
+)
 from app.models.music import MusicJobUpdateResponse
 from app.pubsub import PubSub
 from app.queue.app import celery
-from app.queue.task import QueueTask
-from app.services import tempfiles
+from app.queue.scheduler import FairScheduler, Lanes
+from app.queue.task import QueueTask, RetryPolicy
+from app.services import redispool, tempfiles
 from app.settings import settings
+from app.utils.youtube import get_video_key
+
+logger = logging.getLogger(__name__)
 
 JOB_DIR = "music_jobs"
+CACHE_DIR = "cache"
+STAGE_DIR = "stages"
+CACHED_TRANSCODE_ACTION = "cached"
 
 
-async def retrieve_audio_file(music_job: MusicJob):
-    jobs_root_directory = await tempfiles.create_new_directory(JOB_DIR)
-    job_file_path = Path(jobs_root_directory).joinpath(str(music_job.id))
-    await aiofiles.os.mkdir(job_file_path)
+class MusicJobSourceNotFoundError(Exception):
+    pass
 
-    filename = None
-    if music_job.filename_url:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(music_job.filename_url)
-            audio_file_path = job_file_path.joinpath(
-                f"temp{Path(music_job.original_filename).suffix}"
+
+class MusicJobNotUploadedError(Exception):
+    pass
+
+
+class ProgressReporter:
+    def __init__(
+        self,
+        music_job_id: str,
+        stage: str,
+        pubsub: PubSub,
+        rate: float = settings.music_job_progress_rate,
+    ):
+        self.music_job_id = music_job_id
+        self.stage = stage
+        self.pubsub = pubsub
+        self.interval = 1 / rate
+        self._published_at = None
+        self._tasks: set[asyncio.Task] = set()
+
+    async def _publish(self, message: str):
+        try:
+            await self.pubsub.publish_message(message, log=False)
+        except Exception:
+            logger.exception(f"Failed to publish progress of {self.music_job_id}")
+
+    def update(
+        self,
+        progress: float | None = None,
+        processed_bytes: int | None = None,
+        eta: float | None = None,
+    ):
+        now = time.monotonic()
+        if self._published_at is not None and now - self._published_at < self.interval:
+            return
+        self._published_at = now
+        message = MusicJobUpdateResponse(
+            id=self.music_job_id,
+            status="PROGRESS",
+            stage=self.stage,
+            progress=round(min(progress, 100), 1) if progress is not None else None,
+            processed_bytes=processed_bytes,
+            eta=round(eta, 1) if eta is not None else None,
+        )
+        task = asyncio.create_task(
+            self._publish(json.dumps(message.model_dump(exclude_none=True)))
+        )
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def update_from_download(self, loop: asyncio.AbstractEventLoop, status: dict):
+        if status.get("status") != "downloading":
+            return
+        downloaded = status.get("downloaded_bytes")
+        total = status.get("total_bytes") or status.get("total_bytes_estimate")
+        loop.call_soon_threadsafe(
+            partial(
+                self.update,
+                progress=downloaded / total * 100 if downloaded and total else None,
+                processed_bytes=downloaded,
+                eta=status.get("eta"),
+            )
+        )
+
+    def update_from_transcode(
+        self, progress: ffmpeg.TranscodeProgress, duration: float | None = None
+    ):
+        percent = eta = None
+        if duration and progress.out_time is not None:
+            percent = progress.out_time / duration * 100
+            if progress.speed:
+                eta = max(duration - progress.out_time, 0) / progress.speed
+        self.update(progress=percent, processed_bytes=progress.total_size, eta=eta)
+
+    async def wait(self):
+        await asyncio.gather(*self._tasks)
+
+
+def get_video_cache_filename(video_url: str, extension: str = "mp3"):
+    video_key = get_video_key(video_url)
+    digest = hashlib.sha256(
+        f"{video_key}|{' '.join(ffmpeg.MP3_OUTPUT_ARGS)}".encode()
+    ).hexdigest()
+    return f"{settings.aws_s3_music_folder}/{CACHE_DIR}/{digest}.{extension}"
+
+
+def get_music_job_pubsub(music_job: MusicJob):
+    return PubSub(
+        channels=[
+            PubSub.get_user_channel(
+                PubSub.Channels.MUSIC_JOB_UPDATE, music_job.user_email
+            )
+        ],
+        log_max_length=settings.pubsub_log_max_length,
+    )
+
+
+def get_stage_filename(music_job: MusicJob, name: str):
+    return f"{settings.aws_s3_music_folder}/{music_job.id}/{STAGE_DIR}/{name}"
+
+
+def get_download_filename(music_job: MusicJob):
+    return sanitize_filename("{folder}/{job_id}/{title} {artist}.mp3").format(
+        folder=settings.aws_s3_music_folder,
+        job_id=str(music_job.id),
+        title=music_job.title.lower(),
+        artist=music_job.artist.lower(),
+    )
+
+
+@asynccontextmanager
+async def hold_cache_lock(redis: Redis, name: str):
+    lock = redis.lock(name, timeout=settings.music_cache_lock_timeout)
+    await lock.acquire()
+
+    async def _extend():
+        while True:
+            await asyncio.sleep(settings.music_cache_lock_timeout / 3)
+            await lock.reacquire()
+
+    extend_task = asyncio.create_task(_extend())
+    try:
+        yield
+    finally:
+        extend_task.cancel()
+        await asyncio.gather(extend_task, return_exceptions=True)
+        try:
+            await lock.release()
+        except LockError:
+            # The work is done either way, at worst another job repeated it.
+            logger.warning(f"Lost cache lock {name} before releasing it")
+
+
+def record_transcode_decision(
+    music_job: MusicJob,
+    probe: ffmpeg.AudioProbe,
+    decision: ffmpeg.TranscodeDecision,
+):
+    music_job.source_container = probe.container
+    music_job.source_codec = probe.codec
+    music_job.source_bitrate = probe.bitrate
+    music_job.transcode_action = decision.action
+
+
+async def retrieve_video_source(
+    music_job: MusicJob, redis: Redis, progress: ProgressReporter | None = None
+):
+    master_filename = get_video_cache_filename(video_url=music_job.video_url)
+    if await s3.file_exists(filename=master_filename):
+        return master_filename
+
+    source_filename = get_video_cache_filename(
+        video_url=music_job.video_url, extension="source"
+    )
+    async with hold_cache_lock(redis=redis, name=f"music_cache:{source_filename}"):
+        for filename in [master_filename, source_filename]:
+            if await s3.file_exists(filename=filename):
+                return filename
+        jobs_root_directory = await tempfiles.create_new_directory(JOB_DIR)
+        job_file_path = Path(jobs_root_directory).joinpath(str(music_job.id))
+        await aiofiles.os.mkdir(job_file_path)
+        try:
+            # NOTE: Invidious doesn't work atm
+            # if "youtube.com" in music_job.video_url:
+            #     video_id = parse_youtube_video_id(music_job.video_url)
+            #     audio_file_path = Path(job_file_path).joinpath("temp.audio")
+            #     await invidious.download_audio_from_youtube_video(
+            #         video_id=video_id, download_path=audio_file_path
+            #     )
+            # else:
+            audio_file_path = await ytdlp.download_audio_from_video(
+                url=music_job.video_url,
+                download_path=str(Path(job_file_path).joinpath("temp")),
+                redis=redis,
+                progress_hook=partial(
+                    progress.update_from_download, asyncio.get_running_loop()
+                )
+                if progress
+                else None,
             )
+            await s3.upload_path(
+                filename=source_filename,
+                path=audio_file_path,
+                content_type="application/octet-stream",
+            )
+        finally:
+            await asyncio.to_thread(shutil.rmtree, job_file_path, ignore_errors=True)
+    return source_filename
 
-            async with aiofiles.open(audio_file_path, mode="wb") as f:
-                await f.write(response.content)
 
-            filename = await ffmpeg.convert_audio_to_mp3(audio_file=audio_file_path)
+async def retrieve_audio_source(
+    music_job: MusicJob, redis: Redis, progress: ProgressReporter | None = None
+):
+    if music_job.filename_url:
+        return music_job.original_filename
     elif music_job.video_url:
-        # NOTE: Invidious doesn't work atm
-        # if "youtube.com" in music_job.video_url:
-        #     video_id = parse_youtube_video_id(music_job.video_url)
-        #     audio_file_path = Path(job_file_path).joinpath("temp.audio")
-        #     await invidious.download_audio_from_youtube_video(
-        #         video_id=video_id, download_path=audio_file_path
-        #     )
-        #     filename = await ffmpeg.convert_audio_to_mp3(audio_file=audio_file_path)
-        # else:
-        filename = str(Path(job_file_path).joinpath("temp.mp3"))
-        await ytdlp.download_audio_from_video(
-            url=music_job.video_url, download_path=filename.replace(".mp3", "")
-        )
-    return filename
-
-
-def update_audio_tags(
+        return await retrieve_video_source(
+            music_job=music_job, redis=redis, progress=progress
+        )
+    return None
+
+
+async def transcode_audio_source(
     music_job: MusicJob,
-    filename: str,
-    artwork_info: imagedownloader.RetrievedArtwork,
+    source_filename: str,
+    redis: Redis,
+    progress: ProgressReporter | None = None,
 ):
-    audio_tag_service = audiotags.AudioTags(file_path=filename)
-    audio_tag_service.title = music_job.title
-    audio_tag_service.artist = music_job.artist
-    audio_tag_service.album = music_job.album
-    if music_job.grouping:
-        audio_tag_service.grouping = music_job.grouping
-    if artwork_info:
-        audio_tag_service.set_artwork(
-            data=artwork_info.image,
-            mime_type=f"image/{artwork_info.extension}",
+    if music_job.video_url:
+        master_filename = get_video_cache_filename(video_url=music_job.video_url)
+        if source_filename == master_filename:
+            music_job.transcode_action = CACHED_TRANSCODE_ACTION
+            return master_filename
+        output_filename = master_filename
+    else:
+        output_filename = get_stage_filename(music_job=music_job, name="audio.mp3")
+
+    async with hold_cache_lock(redis=redis, name=f"music_cache:{output_filename}"):
+        if music_job.video_url and await s3.file_exists(filename=output_filename):
+            music_job.transcode_action = CACHED_TRANSCODE_ACTION
+            return output_filename
+        source_url = s3.resolve_url(filename=source_filename)
+        probe = await ffmpeg.probe(source=source_url)
+        decision = ffmpeg.get_transcode_decision(probe=probe)
+        record_transcode_decision(music_job=music_job, probe=probe, decision=decision)
+        if not music_job.video_url and decision.action == "copy":
+            return source_filename
+        await ffmpeg.transcode(
+            source=downloader.stream_file(url=source_url)
+            if probe.is_streamable
+            else source_url,
+            output=lambda read: s3.upload_stream(
+                filename=output_filename, read=read, content_type="audio/mpeg"
+            ),
+            output_args=["-map_metadata", "-1", *decision.output_args],
+            on_progress=partial(progress.update_from_transcode, duration=probe.duration)
+            if progress
+            else None,
         )
+    if music_job.video_url:
+        await s3.delete_file(filename=source_filename)
+    return output_filename
+
+
+def get_audio_tags(music_job: MusicJob):
+    tags = {
+        "title": music_job.title,
+        "artist": music_job.artist,
+        "album": music_job.album,
+    }
+    if music_job.grouping:
+        tags["grouping"] = music_job.grouping
+    return tags
 
 
 async def get_artwork_info(music_job: MusicJob):
@@ -79,58 +311,452 @@ async def get_artwork_info(music_job: MusicJob):
         return None
 
 
+async def delete_stage_files(music_job: MusicJob):
+    async for filenames in s3.list_filenames(
+        prefix=get_stage_filename(music_job=music_job, name="")
+    ):
+        if filenames:
+            await s3.delete_files(filenames=filenames)
+
+
+def _is_transient_s3_error(error: ClientError):
+    code = error.response.get("Error", {}).get("Code", "")
+    status_code = error.response.get("ResponseMetadata", {}).get("HTTPStatusCode", 0)
+    return status_code >= 500 or code in ("SlowDown", "RequestTimeout", "Throttling")
+
+
+def _is_transient_http_error(error: httpx.HTTPStatusError):
+    return (
+        error.response.status_code >= 500
+        or error.response.status_code == httpx.codes.TOO_MANY_REQUESTS
+    )
+
+
+def _is_transient_download_error(error: yt_dlp.utils.DownloadError):
+    message = str(error).lower()
+    return any(
+        text in message
+        for text in [
+            "http error 403",
+            "http error 429",
+            "http error 5",
+            "too many requests",
+            "timed out",
+            "connection",
+        ]
+    )
+
+
+MUSIC_JOB_RETRY_POLICIES = [
+    RetryPolicy(
+        errors=(yt_dlp.utils.DownloadError,),
+        max_retries=5,
+        base_delay=30,
+        max_delay=600,
+        when=_is_transient_download_error,
+    ),
+    RetryPolicy(
+        errors=(ClientError,),
+        max_retries=5,
+        base_delay=2,
+        max_delay=120,
+        when=_is_transient_s3_error,
+    ),
+    RetryPolicy(
+        errors=(httpx.HTTPStatusError,),
+        max_retries=5,
+        base_delay=5,
+        max_delay=300,
+        when=_is_transient_http_error,
+    ),
+    RetryPolicy(
+        errors=(
+            BotoCoreError,
+            httpx.TransportError,
+            downloader.IncompleteDownloadError,
+            RedisConnectionError,
+        ),
+        max_retries=5,
+        base_delay=5,
+        max_delay=300,
+    ),
+]
+
+
+def get_music_job_error(exc: Exception):
+    return (str(exc) or exc.__class__.__name__)[:1000]
+
+
+async def publish_music_job_failed(music_job: MusicJob, error: str):
+    await get_music_job_pubsub(music_job=music_job).publish_message(
+        json.dumps(
+            MusicJobUpdateResponse(
+                id=str(music_job.id), status="FAILED", error=error
+            ).model_dump(exclude_none=True)
+        ),
+    )
+
+
+async def fail_music_jobs(music_jobs: list[MusicJob], error: str):
+    async with sqlalchemy_config.get_session() as db_session:
+        music_jobs_repo = await provide_music_jobs_repo(db_session=db_session)
+        for music_job in music_jobs:
+            music_job.failed = datetime.now(tz=UTC)
+            music_job.error = error
+            await music_jobs_repo.update(music_job)
+    for music_job in music_jobs:
+        await publish_music_job_failed(music_job=music_job, error=error)
+
+
+# Not bound, celery only passes the request and error to errbacks that aren't.
 @celery.task
 async def on_failed_music_job(request, exc, traceback):
-    print(request)
+    if not (music_job_id := request.kwargs.get("music_job_id")):
+        return
+    logger.error(f"Music job {music_job_id} failed: {exc!r}")
+    error = get_music_job_error(exc)
+    async with QueueTask.get_sessionmaker()(expire_on_commit=False) as db_session:
+        music_jobs_repo = await provide_music_jobs_repo(db_session=db_session)
+        if music_job := await music_jobs_repo.get_one_or_none(
+            MusicJob.id == music_job_id
+        ):
+            await delete_stage_files(music_job=music_job)
+            if music_job.reached_stage(MusicJobStage.TRANSCODED):
+                music_job.stage = MusicJobStage.FETCHED
+                music_job.audio_filename = None
+                music_job.tagged_filename = None
+            # Only transcoding deletes the downloaded source of a video.
+            elif music_job.video_url:
+                await s3.delete_file(
+                    filename=get_video_cache_filename(
+                        video_url=music_job.video_url, extension="source"
+                    )
+                )
+                if music_job.reached_stage(MusicJobStage.FETCHED):
+                    music_job.stage = MusicJobStage.UPLOADED
+                    music_job.source_filename = None
+            music_job.failed = datetime.now(tz=UTC)
+            music_job.error = error
+            await music_jobs_repo.update(music_job)
+            await publish_music_job_failed(music_job=music_job, error=error)
+    await music_job_scheduler.release(redis=redispool.get_client(), job_id=music_job_id)
+
+
+async def get_music_job(db_session: AsyncSession, music_job_id: str):
+    music_jobs_repo = await provide_music_jobs_repo(db_session=db_session)
+    music_job = await music_jobs_repo.get_one(MusicJob.id == music_job_id)
+    # Returns the connection while the stage runs, its session doesn't expire
+    # the job on commit.
+    await db_session.commit()
+    return music_job
 
 
-@celery.task(bind=True, link_error=on_failed_music_job.s())
-async def run_music_job(self: QueueTask, music_job_id: str):
-    pubsub = PubSub(channels=[PubSub.Channels.MUSIC_JOB_UPDATE])
-    async with self.db_session() as db_session:
+@celery.task(bind=True, retry_policies=MUSIC_JOB_RETRY_POLICIES)
+async def fetch_music_job(self: QueueTask, music_job_id: str):
+    async with self.db_session(expire_on_commit=False) as db_session:
         music_jobs_repo = await provide_music_jobs_repo(db_session=db_session)
-        music_job = await music_jobs_repo.get_one(MusicJob.id == music_job_id)
+        music_job = await get_music_job(
+            db_session=db_session, music_job_id=music_job_id
+        )
+        pubsub = get_music_job_pubsub(music_job=music_job)
         await pubsub.publish_message(
             json.dumps(
-                MusicJobUpdateResponse(id=music_job_id, status="STARTED").model_dump()
+                MusicJobUpdateResponse(id=music_job_id, status="STARTED").model_dump(
+                    exclude_none=True
+                )
             ),
         )
+        if music_job.reached_stage(MusicJobStage.FETCHED):
+            return
 
-        if not (filename := await retrieve_audio_file(music_job=music_job)):
-            raise Exception("File not found")
+        progress = ProgressReporter(
+            music_job_id=music_job_id, stage="fetch", pubsub=pubsub
+        )
+        async with self.redis_client() as redis:
+            source_filename = await retrieve_audio_source(
+                music_job=music_job, redis=redis, progress=progress
+            )
+        await progress.wait()
+        if not source_filename:
+            raise MusicJobSourceNotFoundError("File not found")
+        music_job.source_filename = source_filename
+        music_job.stage = MusicJobStage.FETCHED
+        await music_jobs_repo.update(music_job)
 
-        artwork_info = await get_artwork_info(music_job=music_job)
 
-        await asyncio.to_thread(
-            update_audio_tags,
-            music_job=music_job,
-            filename=filename,
-            artwork_info=artwork_info,
+@celery.task(bind=True, retry_policies=MUSIC_JOB_RETRY_POLICIES)
+async def transcode_music_job(self: QueueTask, music_job_id: str):
+    async with self.db_session(expire_on_commit=False) as db_session:
+        music_jobs_repo = await provide_music_jobs_repo(db_session=db_session)
+        music_job = await get_music_job(
+            db_session=db_session, music_job_id=music_job_id
         )
+        pubsub = get_music_job_pubsub(music_job=music_job)
+        if music_job.reached_stage(MusicJobStage.TRANSCODED):
+            return
 
-        new_filename = sanitize_filename(
-            "{folder}/{job_id}/{title} {artist}.mp3"
-        ).format(
-            folder=settings.aws_s3_music_folder,
-            job_id=str(music_job.id),
-            title=music_job.title.lower(),
-            artist=music_job.artist.lower(),
+        progress = ProgressReporter(
+            music_job_id=music_job_id, stage="transcode", pubsub=pubsub
         )
-
-        async with aiofiles.open(filename, mode="rb") as f:
-            await s3.upload_file(
-                filename=new_filename,
-                body=await f.read(),
-                content_type="audio/mpeg",
+        async with self.redis_client() as redis:
+            audio_filename = await transcode_audio_source(
+                music_job=music_job,
+                source_filename=music_job.source_filename,
+                redis=redis,
+                progress=progress,
             )
+        await progress.wait()
+        music_job.audio_filename = audio_filename
+        music_job.stage = MusicJobStage.TRANSCODED
+        await music_jobs_repo.update(music_job)
+
+
+@celery.task(bind=True, retry_policies=MUSIC_JOB_RETRY_POLICIES)
+async def tag_music_job(self: QueueTask, music_job_id: str):
+    async with self.db_session(expire_on_commit=False) as db_session:
+        music_jobs_repo = await provide_music_jobs_repo(db_session=db_session)
+        music_job = await get_music_job(
+            db_session=db_session, music_job_id=music_job_id
+        )
+        pubsub = get_music_job_pubsub(music_job=music_job)
+        if music_job.reached_stage(MusicJobStage.TAGGED):
+            return
 
-        music_job.download_filename = new_filename
-        music_job.download_url = s3.resolve_url(filename=new_filename)
-        music_job.completed = datetime.now(tz=UTC)
+        artwork_info = await get_artwork_info(music_job=music_job)
+        tagged_filename = get_stage_filename(music_job=music_job, name="tagged.mp3")
+        progress = ProgressReporter(
+            music_job_id=music_job_id, stage="tag", pubsub=pubsub
+        )
+        await ffmpeg.transcode(
+            source=downloader.stream_file(
+                url=s3.resolve_url(filename=music_job.audio_filename)
+            ),
+            output=lambda read: s3.upload_stream(
+                filename=tagged_filename, read=read, content_type="audio/mpeg"
+            ),
+            output_args=ffmpeg.MP3_COPY_OUTPUT_ARGS,
+            tags=get_audio_tags(music_job=music_job),
+            artwork=artwork_info.image if artwork_info else None,
+            artwork_mime_type=f"image/{artwork_info.extension}"
+            if artwork_info
+            else None,
+            on_progress=progress.update_from_transcode,
+            # Runs on the I/O workers.
+            use_slot=False,
+        )
+        await progress.wait()
+        music_job.tagged_filename = tagged_filename
+        music_job.stage = MusicJobStage.TAGGED
         await music_jobs_repo.update(music_job)
 
+
+@celery.task(bind=True, retry_policies=MUSIC_JOB_RETRY_POLICIES)
+async def upload_music_job(self: QueueTask, music_job_id: str):
+    async with self.db_session(expire_on_commit=False) as db_session:
+        music_jobs_repo = await provide_music_jobs_repo(db_session=db_session)
+        music_job = await get_music_job(
+            db_session=db_session, music_job_id=music_job_id
+        )
+        pubsub = get_music_job_pubsub(music_job=music_job)
+        if not music_job.reached_stage(MusicJobStage.STORED):
+            new_filename = get_download_filename(music_job=music_job)
+            await s3.copy_file(
+                source_filename=music_job.tagged_filename, filename=new_filename
+            )
+            music_job.download_filename = new_filename
+            music_job.download_url = s3.resolve_url(filename=new_filename)
+            music_job.completed = datetime.now(tz=UTC)
+            music_job.stage = MusicJobStage.STORED
+            await music_jobs_repo.update(music_job)
+        await delete_stage_files(music_job=music_job)
+
         await pubsub.publish_message(
             json.dumps(
-                MusicJobUpdateResponse(id=music_job_id, status="COMPLETED").model_dump()
+                MusicJobUpdateResponse(id=music_job_id, status="COMPLETED").model_dump(
+                    exclude_none=True
+                )
+            ),
+        )
+
+    async with self.redis_client() as redis:
+        await music_job_scheduler.release(redis=redis, job_id=music_job_id)
+
+
+def get_music_job_pipeline(music_job_id: str):
+    return chain(
+        fetch_music_job.si(music_job_id=music_job_id),
+        transcode_music_job.si(music_job_id=music_job_id),
+        tag_music_job.si(music_job_id=music_job_id),
+        upload_music_job.si(music_job_id=music_job_id),
+    ).on_error(on_failed_music_job.s())
+
+
+async def _send_music_jobs(music_job_ids: list[str]):
+    await asyncio.to_thread(
+        group(
+            get_music_job_pipeline(music_job_id=music_job_id)
+            for music_job_id in music_job_ids
+        ).delay
+    )
+
+
+music_job_scheduler = FairScheduler(
+    name="music_jobs",
+    send=_send_music_jobs,
+    max_in_flight=settings.music_scheduler_max_in_flight,
+    max_in_flight_per_user=settings.music_scheduler_max_in_flight_per_user,
+    quantum=settings.music_scheduler_quantum,
+    in_flight_timeout=settings.music_scheduler_in_flight_timeout,
+)
+
+
+@celery.task(bind=True)
+async def dispatch_music_jobs(self: QueueTask):
+    async with self.redis_client() as redis:
+        await music_job_scheduler.dispatch(redis=redis)
+
+
+async def schedule_music_job(
+    redis: Redis, music_job: MusicJob, lane: str = Lanes.DEFAULT
+):
+    await schedule_music_jobs(redis=redis, music_jobs=[music_job], lane=lane)
+
+
+async def schedule_music_jobs(
+    redis: Redis, music_jobs: list[MusicJob], lane: str = Lanes.DEFAULT
+):
+    jobs_by_user: dict[str, list[MusicJob]] = {}
+    for music_job in music_jobs:
+        if not music_job.reached_stage(MusicJobStage.UPLOADED):
+            raise MusicJobNotUploadedError("Music job input is not uploaded")
+        jobs_by_user.setdefault(music_job.user_email, []).append(music_job)
+    for user_email, user_music_jobs in jobs_by_user.items():
+        await music_job_scheduler.schedule_many(
+            redis=redis,
+            job_ids=[str(music_job.id) for music_job in user_music_jobs],
+            user=user_email,
+            lane=lane,
+        )
+
+
+async def submit_music_job(
+    redis: Redis,
+    music_job: MusicJob,
+    file: UploadFile | None = None,
+    artwork_url: str | None = None,
+    lane: str = Lanes.DEFAULT,
+):
+    try:
+        await music_job.upload_files(file=file, artwork_url=artwork_url)
+        await schedule_music_job(redis=redis, music_job=music_job, lane=lane)
+    except Exception as e:
+        logger.exception(f"Failed to submit music job {music_job.id}")
+        await fail_music_jobs(music_jobs=[music_job], error=get_music_job_error(e))
+
+
+def get_playlist_artwork_url(playlist: dict):
+    if thumbnails := playlist.get("thumbnails"):
+        return thumbnails[-1].get("url")
+    return playlist.get("thumbnail")
+
+
+def get_playlist_artist(playlist: dict):
+    artist = (
+        playlist.get("artist") or playlist.get("uploader") or playlist.get("channel")
+    )
+    # Auto-generated YouTube album playlists belong to "<artist> - Topic".
+    return artist.removesuffix(" - Topic") if artist else None
+
+
+async def submit_music_playlist(
+    redis: Redis,
+    user_email: str,
+    playlist_url: str,
+    artwork_url: str | None = None,
+    artist: str | None = None,
+    album: str | None = None,
+    grouping: str | None = None,
+    lane: str = Lanes.DEFAULT,
+):
+    music_jobs: list[MusicJob] = []
+    is_artwork_resolved = False
+    resolved_artwork_url = None
+    count = 0
+
+    async def _flush():
+        async with sqlalchemy_config.get_session() as db_session:
+            music_jobs_repo = await provide_music_jobs_repo(db_session=db_session)
+            # add_many returns the list it is given, which is reused.
+            created_music_jobs = await music_jobs_repo.add_many(list(music_jobs))
+        music_jobs.clear()
+        try:
+            await schedule_music_jobs(
+                redis=redis, music_jobs=created_music_jobs, lane=lane
+            )
+        except Exception as e:
+            logger.exception(f"Failed to schedule music jobs of {playlist_url}")
+            await fail_music_jobs(
+                music_jobs=created_music_jobs, error=get_music_job_error(e)
+            )
+
+    try:
+        async for playlist, entry in ytdlp.iter_playlist_entries(url=playlist_url):
+            if not is_artwork_resolved:
+                is_artwork_resolved = True
+                if artwork_url := artwork_url or get_playlist_artwork_url(playlist):
+                    try:
+                        resolved_artwork_url = await resolve_shared_artwork_url(
+                            artwork_url
+                        )
+                    except Exception:
+                        logger.exception(
+                            f"Failed to resolve artwork for {playlist_url}"
+                        )
+            entry_artist = (
+                artist
+                or get_playlist_artist(playlist)
+                or entry.get("uploader")
+                or entry.get("channel")
+            )
+            entry_album = album or playlist.get("title")
+            entry_url = entry.get("webpage_url") or entry.get("url")
+            if not (entry_artist and entry_album and entry_url):
+                logger.warning(
+                    f"Skipping {entry.get('id')} of {playlist_url}, missing tags"
+                )
+                continue
+            music_jobs.append(
+                MusicJob(
+                    user_email=user_email,
+                    video_url=entry_url,
+                    artwork_url=resolved_artwork_url,
+                    title=entry.get("title") or entry.get("id"),
+                    artist=entry_artist,
+                    album=entry_album,
+                    grouping=grouping,
+                    stage=MusicJobStage.UPLOADED,
+                )
+            )
+            count += 1
+            if len(music_jobs) >= settings.music_playlist_batch_size:
+                await _flush()
+            if count >= settings.music_playlist_max_entries:
+                logger.warning(f"Truncating {playlist_url} to {count} entries")
+                break
+        if music_jobs:
+            await _flush()
+    except Exception as e:
+        # Entries that weren't inserted have no job to fail.
+        logger.exception(f"Failed to submit playlist {playlist_url}")
+        await PubSub(
+            channels=[
+                PubSub.get_user_channel(PubSub.Channels.MUSIC_JOB_UPDATE, user_email)
+            ],
+            log_max_length=settings.pubsub_log_max_length,
+        ).publish_message(
+            json.dumps(
+                MusicJobUpdateResponse(
+                    id=playlist_url, status="FAILED", error=get_music_job_error(e)
+                ).model_dump(exclude_none=True)
             ),
         )
@@ -0,0 +1,326 @@
+import json
+import time
+from collections import deque
+from typing import Awaitable, Callable
+
+from redis.asyncio import Redis
+
+from app.models import Response
+
+
+class Lanes:
+    PRIORITY = "PRIORITY"
+    DEFAULT = "DEFAULT"
+
+
+# Lanes are served in this order, a lane only gets capacity once every lane
+# before it is empty.
+LANES = [Lanes.PRIORITY, Lanes.DEFAULT]
+
+
+class UserWaitStats(Response):
+    user: str
+    pending: int
+    in_flight: int
+    dispatched: int
+    total_wait_time: float
+    max_wait_time: float
+
+
+class SchedulerStats(Response):
+    in_flight: int
+    max_in_flight: int
+    users: list[UserWaitStats]
+
+
+class LaneState:
+    # A lane as read by a dispatch, the jobs it picks are applied to it before
+    # it is written back.
+    def __init__(self, ring: deque[str], deficits: dict[str, float]):
+        self.ring = ring
+        self.deficits = deficits
+        self.lengths: dict[str, int] = {}
+        self.popped: dict[str, int] = {}
+        self.removed: list[str] = []
+
+    def remove_user(self):
+        user = self.ring.popleft()
+        self.deficits.pop(user, None)
+        self.removed.append(user)
+
+    def rotate_user(self, deficit: float):
+        user = self.ring[0]
+        self.ring.rotate(-1)
+        self.deficits[user] = deficit
+
+
+class FairScheduler:
+    # Holds jobs back from Celery and releases them with deficit round robin
+    # across users, so one user's batch doesn't delay everybody else's jobs.
+    # At most `max_in_flight` jobs are handed to the workers at a time, the
+    # rest wait in per-user queues in redis until a running job is released.
+    # `max_in_flight_per_user` caps a single user's share of that, so a large
+    # batch can't take every slot even while nobody else is waiting.
+    def __init__(
+        self,
+        name: str,
+        send: Callable[[list[str]], Awaitable],
+        max_in_flight: int,
+        max_in_flight_per_user: int | None = None,
+        quantum: float = 1,
+        in_flight_timeout: int = 3600,
+        lock_timeout: int = 60,
+    ):
+        self.name = name
+        self.send = send
+        self.max_in_flight = max_in_flight
+        self.max_in_flight_per_user = max_in_flight_per_user
+        self.quantum = quantum
+        self.in_flight_timeout = in_flight_timeout
+        self.lock_timeout = lock_timeout
+
+    def _key(self, *parts: str):
+        return ":".join(["scheduler", self.name, *parts])
+
+    def _lock(self, redis: Redis):
+        return redis.lock(self._key("lock"), timeout=self.lock_timeout)
+
+    async def schedule(self, redis: Redis, job_id: str, user: str, lane: str):
+        await self.schedule_many(redis=redis, job_ids=[job_id], user=user, lane=lane)
+
+    async def schedule_many(
+        self, redis: Redis, job_ids: list[str], user: str, lane: str
+    ):
+        enqueued_at = time.time()
+        items = [
+            {"id": job_id, "user": user, "lane": lane, "enqueued_at": enqueued_at}
+            for job_id in job_ids
+        ]
+        async with self._lock(redis):
+            await self._push(redis=redis, items=items)
+        await self.dispatch(redis)
+
+    async def _push(self, redis: Redis, items: list[dict], front=False):
+        queues: dict[tuple[str, str], list[dict]] = {}
+        for item in items:
+            queues.setdefault((item["lane"], item["user"]), []).append(item)
+        async with redis.pipeline(transaction=False) as pipe:
+            for (lane, user), queue_items in queues.items():
+                # LPUSH inserts its values one by one, so they are reversed to
+                # keep their order at the front of the queue.
+                values = [
+                    json.dumps(item)
+                    for item in (reversed(queue_items) if front else queue_items)
+                ]
+                push = pipe.lpush if front else pipe.rpush
+                push(self._key(lane, "queue", user), *values)
+                pipe.sadd(self._key(lane, "users"), user)
+                pipe.sadd(self._key("users"), user)
+            results = await pipe.execute()
+        if added := [queue for queue, result in zip(queues, results[1::3]) if result]:
+            async with redis.pipeline(transaction=False) as pipe:
+                for lane, user in added:
+                    pipe.rpush(self._key(lane, "ring"), user)
+                await pipe.execute()
+
+    async def _add_in_flight(self, redis: Redis, items: list[dict], now: float):
+        async with redis.pipeline(transaction=False) as pipe:
+            pipe.zadd(self._key("in_flight"), {item["id"]: now for item in items})
+            pipe.hset(
+                self._key("in_flight_users"),
+                mapping={item["id"]: item["user"] for item in items},
+            )
+            for item in items:
+                pipe.zadd(self._key("in_flight", item["user"]), {item["id"]: now})
+            await pipe.execute()
+
+    async def _remove_in_flight(self, redis: Redis, job_ids: list[str]):
+        users = await redis.hmget(self._key("in_flight_users"), job_ids)
+        async with redis.pipeline(transaction=False) as pipe:
+            pipe.zrem(self._key("in_flight"), *job_ids)
+            pipe.hdel(self._key("in_flight_users"), *job_ids)
+            for job_id, user in zip(job_ids, users):
+                if user:
+                    pipe.zrem(self._key("in_flight", user.decode()), job_id)
+            await pipe.execute()
+
+    async def release(self, redis: Redis, job_id: str):
+        async with self._lock(redis):
+            await self._remove_in_flight(redis=redis, job_ids=[job_id])
+        await self.dispatch(redis)
+
+    async def _get_lanes(self, redis: Redis):
+        async with redis.pipeline(transaction=False) as pipe:
+            for lane in LANES:
+                pipe.lrange(self._key(lane, "ring"), 0, -1)
+                pipe.hgetall(self._key(lane, "deficit"))
+            results = await pipe.execute()
+        lanes = {}
+        for lane, ring, deficits in zip(LANES, results[::2], results[1::2]):
+            lanes[lane] = LaneState(
+                ring=deque(user.decode() for user in ring),
+                deficits={
+                    user.decode(): float(deficit) for user, deficit in deficits.items()
+                },
+            )
+        users = sorted({user for state in lanes.values() for user in state.ring})
+        async with redis.pipeline(transaction=False) as pipe:
+            for lane, state in lanes.items():
+                for user in state.ring:
+                    pipe.llen(self._key(lane, "queue", user))
+            for user in users:
+                pipe.zcard(self._key("in_flight", user))
+            results = iter(await pipe.execute())
+        for state in lanes.values():
+            for user in state.ring:
+                state.lengths[user] = next(results)
+        return lanes, dict(zip(users, results))
+
+    def _next_job(self, lanes: dict[str, LaneState], in_flight: dict[str, int]):
+        for lane in LANES:
+            state = lanes[lane]
+            # Users at their in-flight cap are passed over, the lane is done
+            # once every user left in its ring has been passed over.
+            skipped = 0
+            while skipped < len(state.ring):
+                user = state.ring[0]
+                if not state.lengths[user]:
+                    state.remove_user()
+                    continue
+                deficit = state.deficits.get(user, 0)
+                if (
+                    self.max_in_flight_per_user is not None
+                    and in_flight[user] >= self.max_in_flight_per_user
+                ):
+                    state.rotate_user(deficit=deficit)
+                    skipped += 1
+                    continue
+                if deficit < 1:
+                    # The user's turn starts, a quantum below one job carries
+                    # over to their next turn.
+                    deficit += self.quantum
+                    if deficit < 1:
+                        state.rotate_user(deficit=deficit)
+                        skipped = 0
+                        continue
+                state.lengths[user] -= 1
+                state.popped[user] = state.popped.get(user, 0) + 1
+                deficit -= 1
+                if not state.lengths[user]:
+                    state.remove_user()
+                elif deficit < 1:
+                    state.rotate_user(deficit=deficit)
+                else:
+                    state.deficits[user] = deficit
+                return lane, user
+        return None
+
+    async def _pop_jobs(
+        self, redis: Redis, lanes: dict[str, LaneState], picks: list[tuple[str, str]]
+    ):
+        async with redis.pipeline(transaction=False) as pipe:
+            for lane, state in lanes.items():
+                for user, count in state.popped.items():
+                    pipe.lpop(self._key(lane, "queue", user), count)
+            for lane, state in lanes.items():
+                ring_key = self._key(lane, "ring")
+                deficit_key = self._key(lane, "deficit")
+                pipe.delete(ring_key, deficit_key)
+                if state.ring:
+                    pipe.rpush(ring_key, *state.ring)
+                if state.deficits:
+                    pipe.hset(deficit_key, mapping=state.deficits)
+                if state.removed:
+                    pipe.srem(self._key(lane, "users"), *state.removed)
+            results = iter(await pipe.execute())
+        queues = {}
+        for lane, state in lanes.items():
+            for user in state.popped:
+                queues[lane, user] = deque(next(results))
+        return [json.loads(queues[pick].popleft()) for pick in picks]
+
+    async def _record_waits(self, redis: Redis, items: list[dict], now: float):
+        waits: dict[str, list[float]] = {}
+        for item in items:
+            waits.setdefault(item["user"], []).append(now - item["enqueued_at"])
+        async with redis.pipeline(transaction=False) as pipe:
+            for user in waits:
+                pipe.hget(self._key("wait", user), "max_wait_time")
+            max_wait_times = await pipe.execute()
+        async with redis.pipeline(transaction=False) as pipe:
+            for (user, wait_times), max_wait_time in zip(waits.items(), max_wait_times):
+                stats_key = self._key("wait", user)
+                pipe.hincrby(stats_key, "dispatched", len(wait_times))
+                pipe.hincrbyfloat(stats_key, "total_wait_time", sum(wait_times))
+                if max(wait_times) > float(max_wait_time or 0):
+                    pipe.hset(stats_key, "max_wait_time", max(wait_times))
+            await pipe.execute()
+
+    async def dispatch(self, redis: Redis):
+        in_flight_key = self._key("in_flight")
+        async with self._lock(redis):
+            # Jobs whose release never came, e.g. after a worker was killed,
+            # stop holding capacity after a while.
+            if expired := await redis.zrangebyscore(
+                in_flight_key, "-inf", time.time() - self.in_flight_timeout
+            ):
+                await self._remove_in_flight(
+                    redis=redis, job_ids=[job_id.decode() for job_id in expired]
+                )
+            available = self.max_in_flight - await redis.zcard(in_flight_key)
+            if available <= 0:
+                return
+
+            # The lanes are read and written back in a few round trips however
+            # many jobs are picked, the lock keeps them from changing between.
+            lanes, in_flight = await self._get_lanes(redis=redis)
+            picks = []
+            while len(picks) < available:
+                if not (pick := self._next_job(lanes=lanes, in_flight=in_flight)):
+                    break
+                picks.append(pick)
+                in_flight[pick[1]] += 1
+            items = await self._pop_jobs(redis=redis, lanes=lanes, picks=picks)
+            if not items:
+                return
+
+            # Everything released by this pass is sent together.
+            now = time.time()
+            job_ids = [item["id"] for item in items]
+            await self._add_in_flight(redis=redis, items=items, now=now)
+            try:
+                await self.send(job_ids)
+            except Exception:
+                # The jobs keep their place for the next dispatch.
+                await self._remove_in_flight(redis=redis, job_ids=job_ids)
+                await self._push(redis=redis, items=items, front=True)
+                raise
+            await self._record_waits(redis=redis, items=items, now=now)
+
+    async def get_stats(self, redis: Redis):
+        users = []
+        for user in sorted(
+            member.decode() for member in await redis.smembers(self._key("users"))
+        ):
+            stats = {
+                key.decode(): value
+                for key, value in (await redis.hgetall(self._key("wait", user))).items()
+            }
+            pending = 0
+            for lane in LANES:
+                pending += await redis.llen(self._key(lane, "queue", user))
+            users.append(
+                UserWaitStats(
+                    user=user,
+                    pending=pending,
+                    in_flight=await redis.zcard(self._key("in_flight", user)),
+                    dispatched=int(stats.get("dispatched", 0)),
+                    total_wait_time=float(stats.get("total_wait_time", 0)),
+                    max_wait_time=float(stats.get("max_wait_time", 0)),
+                )
+            )
+        return SchedulerStats(
+            in_flight=await redis.zcard(self._key("in_flight")),
+            max_in_flight=self.max_in_flight,
+            users=users,
+        )
@@ -1,34 +1,185 @@
 import asyncio
+import logging
+import os
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import asynccontextmanager
+from typing import Callable
 
 from celery import Task
-from redis.asyncio import Redis
-from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from celery.signals import (
+    worker_init,
+    worker_process_init,
+    worker_process_shutdown,
+    worker_shutdown,
+)
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker, create_async_engine
 
+from app.clients import ffmpeg
+from app.services import redispool
 from app.settings import settings
 
+logger = logging.getLogger(__name__)
+
+
+class RetryPolicy:
+    # Retries errors of the given types with exponential backoff. Half of each
+    # delay is random so tasks that failed together don't retry together.
+    def __init__(
+        self,
+        errors: tuple[type[Exception], ...],
+        max_retries: int,
+        base_delay: float,
+        max_delay: float,
+        when: Callable[[Exception], bool] | None = None,
+    ):
+        self.errors = errors
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.when = when
+
+    def matches(self, error: Exception):
+        return isinstance(error, self.errors) and (
+            self.when is None or self.when(error)
+        )
+
+    def get_countdown(self, retries: int):
+        delay = min(self.max_delay, self.base_delay * 2**retries)
+        return delay / 2 + random.uniform(0, delay / 2)
+
 
 class QueueTask(Task):
+    # Shared by every task in the worker process. asyncpg connections belong to
+    # the loop that opened them, so the pool is only reusable because tasks run
+    # on one long-lived loop instead of a new loop per call.
+    _loop: asyncio.AbstractEventLoop | None = None
+    _loop_thread: threading.Thread | None = None
+    _loop_lock = threading.Lock()
+    _engine: AsyncEngine | None = None
+    _sessionmaker: async_sessionmaker | None = None
+
+    # Checked in order, errors without a matching policy fail the task.
+    retry_policies: list[RetryPolicy] = []
+
+    @classmethod
+    def get_event_loop(cls):
+        with cls._loop_lock:
+            if cls._loop is None or cls._loop.is_closed():
+                cls._loop = asyncio.new_event_loop()
+                if settings.worker_asyncio:
+                    # Every job shares the loop's executor, it is sized so one
+                    # job's blocking downloads don't starve the others'
+                    # to_thread calls.
+                    cls._loop.set_default_executor(
+                        ThreadPoolExecutor(
+                            max_workers=(
+                                settings.worker_concurrency or os.cpu_count() or 1
+                            )
+                            * settings.worker_executor_threads_per_job,
+                            thread_name_prefix="queue-executor",
+                        )
+                    )
+                    # Pool threads hand their coroutines to this loop, so every
+                    # job in the process shares one loop and its connections.
+                    cls._loop_thread = threading.Thread(
+                        target=cls._loop.run_forever, name="queue-loop", daemon=True
+                    )
+                    cls._loop_thread.start()
+            return cls._loop
+
+    @classmethod
+    def run_coroutine(cls, coro):
+        loop = cls.get_event_loop()
+        if cls._loop_thread:
+            return asyncio.run_coroutine_threadsafe(coro, loop).result()
+        return loop.run_until_complete(coro)
+
+    @classmethod
+    def get_sessionmaker(cls):
+        if cls._sessionmaker is None:
+            cls._engine = create_async_engine(
+                settings.async_database_url,
+                pool_size=settings.database_pool_size,
+                max_overflow=settings.database_max_overflow,
+                pool_pre_ping=settings.database_pool_pre_ping,
+                pool_recycle=settings.database_pool_recycle,
+            )
+            cls._sessionmaker = async_sessionmaker(cls._engine)
+        return cls._sessionmaker
+
+    @classmethod
+    def init_worker_process(cls):
+        # A forked child must not reuse connections opened by its parent.
+        if cls._engine:
+            cls._engine.sync_engine.dispose(close=False)
+        cls._loop = None
+        cls._loop_thread = None
+        cls._engine = None
+        cls._sessionmaker = None
+        redispool.init_pool(max_connections=settings.redis_worker_max_connections)
+
+    @classmethod
+    def shutdown_worker_process(cls):
+        logger.info(f"Transcode scheduler: {ffmpeg.scheduler.get_stats()}")
+        if cls._loop and not cls._loop.is_closed():
+            if cls._engine:
+                cls.run_coroutine(cls._engine.dispose())
+            cls.run_coroutine(redispool.close_pool())
+            cls.run_coroutine(cls._loop.shutdown_default_executor())
+            if cls._loop_thread:
+                cls._loop.call_soon_threadsafe(cls._loop.stop)
+                cls._loop_thread.join()
+            cls._loop.close()
+        cls._loop = None
+        cls._loop_thread = None
+        cls._engine = None
+        cls._sessionmaker = None
+
     @asynccontextmanager
-    async def db_session(self):
-        engine = create_async_engine(settings.async_database_url)
-        sessionmaker = async_sessionmaker(engine)
-        async with sessionmaker() as session:
+    async def db_session(self, expire_on_commit: bool = True):
+        async with QueueTask.get_sessionmaker()(
+            expire_on_commit=expire_on_commit
+        ) as session:
             yield session
-        await engine.dispose()
 
     @asynccontextmanager
     async def redis_client(self):
-        redis_client = Redis.from_url(settings.redis_url)
-        try:
-            yield redis_client
-        finally:
-            await redis_client.aclose()
+        yield redispool.get_client()
+
+    def get_retry_policy(self, error: Exception):
+        return next(
+            (policy for policy in self.retry_policies if policy.matches(error)), None
+        )
 
     def __call__(self, *args, **kwargs):
         try:
             loop = asyncio.get_running_loop()
             return loop.create_task(self.run(*args, **kwargs))
         except RuntimeError:
-            loop = asyncio.new_event_loop()
-            return loop.run_until_complete(self.run(*args, **kwargs))
+            pass
+        try:
+            return QueueTask.run_coroutine(self.run(*args, **kwargs))
+        except Exception as e:
+            # Retrying has to happen here, the coroutine may run on a thread
+            # that doesn't have this task's request.
+            if policy := self.get_retry_policy(e):
+                raise self.retry(
+                    exc=e,
+                    countdown=policy.get_countdown(self.request.retries),
+                    max_retries=policy.max_retries,
+                )
+            raise
+
+
+@worker_init.connect
+@worker_process_init.connect
+def init_worker_process(**kwargs):
+    QueueTask.init_worker_process()
+
+
+@worker_process_shutdown.connect
+@worker_shutdown.connect
+def shutdown_worker_process(**kwargs):
+    QueueTask.shutdown_worker_process()
@@ -9,6 +9,7 @@ from litestar.exceptions import (
     ClientException,
 )
 from litestar.params import Body
+from redis.asyncio import Redis
 
 from app.clients import audiotags, google, imagedownloader, ytdlp
 from app.models.music import GroupingResponse, ResolvedArtworkResponse, TagsResponse
@@ -20,13 +21,13 @@ logger = logging.getLogger(__name__)
 
 
 @get("/grouping", status_code=status_codes.HTTP_200_OK, raises=[ClientException])
-async def get_grouping(video_url: str) -> GroupingResponse:
+async def get_grouping(video_url: str, redis: Redis) -> GroupingResponse:
     try:
         if "youtube.com" in video_url:
             video_id = parse_youtube_video_id(video_url)
             uploader = await google.get_video_uploader(video_id=video_id)
         else:
-            video_info = await ytdlp.extract_video_info(url=video_url)
+            video_info = await ytdlp.extract_video_info(url=video_url, redis=redis)
             uploader = video_info.get("uploader")
         return GroupingResponse(grouping=uploader)
     except Exception:
@@ -1,21 +1,75 @@
+import asyncio
+import json
+import logging
 import re
 from typing import Annotated, Any
 
-from litestar import Controller, Request, Response, post, status_codes
-from litestar.background_tasks import BackgroundTask, BackgroundTasks
+from litestar import (
+    Controller,
+    Request,
+    Response,
+    WebSocket,
+    get,
+    post,
+    status_codes,
+    websocket,
+)
+from litestar.background_tasks import BackgroundTask
 from litestar.di import Provide
 from litestar.enums import RequestEncodingType
-from litestar.exceptions import ClientException
-from litestar.params import Body
+from litestar.exceptions import ClientException, WebSocketDisconnect
+from litestar.params import Body, Parameter
+from litestar.response import ServerSentEvent, ServerSentEventMessage
+from redis.asyncio import Redis
 
 from app.db.models.musicjob import (
     MusicJob,
     MusicJobRespository,
+    MusicJobStage,
     provide_music_jobs_repo,
+    resolve_shared_artwork_url,
 )
 from app.db.models.users import User
-from app.models.music import CreateMusicJob
-from app.queue.music import run_music_job
+from app.models.music import (
+    CreatedMusicJobsResponse,
+    CreateMusicJob,
+    CreateMusicJobs,
+    CreateMusicPlaylistJobs,
+)
+from app.pubsub import (
+    PubSub,
+    PubSubHub,
+    PubSubHubStats,
+    SubscriptionOverflowError,
+)
+from app.queue.music import (
+    music_job_scheduler,
+    schedule_music_jobs,
+    submit_music_job,
+    submit_music_playlist,
+)
+from app.queue.scheduler import Lanes, SchedulerStats
+from app.session import admin_guard
+from app.settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+def get_music_job_update_key(data: str):
+    return json.loads(data)["id"]
+
+
+def is_music_job_progress(data: str):
+    return json.loads(data)["status"] == "PROGRESS"
+
+
+music_job_updates = PubSubHub(
+    # Each update carries the whole state of its job, a newer one for the
+    # same job makes a queued one redundant.
+    coalesce_key=get_music_job_update_key,
+    # Progress isn't logged, it is sent without an event id.
+    is_transient=is_music_job_progress,
+)
 
 
 class JobController(Controller):
@@ -31,6 +85,7 @@ class JobController(Controller):
             CreateMusicJob, Body(media_type=RequestEncodingType.MULTI_PART)
         ],
         music_jobs_repo: MusicJobRespository,
+        redis: Redis,
     ) -> None:
         if data.file and data.video_url:
             raise ClientException(
@@ -61,17 +116,196 @@ class JobController(Controller):
         return Response(
             content=None,
             status_code=status_codes.HTTP_201_CREATED,
-            background=BackgroundTasks(
-                tasks=[
-                    BackgroundTask(
-                        music_job.upload_files,
-                        data.file,
-                        data.artwork_url,
-                    ),
-                    BackgroundTask(
-                        run_music_job.delay,
-                        music_job_id=str(music_job.id),
+            # The job is only scheduled once its upload is committed, so the
+            # worker always finds its input.
+            background=BackgroundTask(
+                submit_music_job,
+                redis=redis,
+                music_job=music_job,
+                file=data.file,
+                artwork_url=data.artwork_url,
+                # Single jobs are interactive, they skip ahead of batches.
+                lane=Lanes.PRIORITY,
+            ),
+        )
+
+    @post(path="/create/bulk", status_code=status_codes.HTTP_201_CREATED)
+    async def create_jobs(
+        self,
+        request: Request[User, Any, Any],
+        data: CreateMusicJobs,
+        music_jobs_repo: MusicJobRespository,
+        redis: Redis,
+    ) -> Response[CreatedMusicJobsResponse]:
+        # Every distinct artwork is resolved once, however many jobs share it.
+        artwork_urls = list(
+            {job.artwork_url or data.artwork_url for job in data.jobs} - {None}
+        )
+        resolved_artwork_urls = dict(
+            zip(
+                artwork_urls,
+                await asyncio.gather(
+                    *[resolve_shared_artwork_url(url) for url in artwork_urls],
+                    return_exceptions=True,
+                ),
+            )
+        )
+        for resolved_artwork_url in resolved_artwork_urls.values():
+            if isinstance(resolved_artwork_url, Exception):
+                logger.error(
+                    f"Failed to resolve artwork for {request.user.email}",
+                    exc_info=resolved_artwork_url,
+                )
+        if not all(isinstance(url, str) for url in resolved_artwork_urls.values()):
+            raise ClientException(
+                detail="Artwork could not be resolved.",
+                status_code=status_codes.HTTP_400_BAD_REQUEST,
+            )
+        music_jobs = []
+        for job in data.jobs:
+            music_jobs.append(
+                MusicJob(
+                    user_email=request.user.email,
+                    video_url=job.video_url.unicode_string(),
+                    artwork_url=resolved_artwork_urls.get(
+                        job.artwork_url or data.artwork_url
                     ),
-                ]
+                    title=job.title,
+                    artist=job.artist or data.artist,
+                    album=job.album or data.album,
+                    grouping=job.grouping or data.grouping,
+                    stage=MusicJobStage.UPLOADED,
+                )
+            )
+        music_jobs = await music_jobs_repo.add_many(music_jobs)
+        return Response(
+            content=CreatedMusicJobsResponse(
+                ids=[str(music_job.id) for music_job in music_jobs]
+            ),
+            status_code=status_codes.HTTP_201_CREATED,
+            background=BackgroundTask(
+                schedule_music_jobs,
+                redis=redis,
+                music_jobs=music_jobs,
+                lane=Lanes.DEFAULT,
             ),
         )
+
+    @post(path="/create/playlist", status_code=status_codes.HTTP_201_CREATED)
+    async def create_playlist_jobs(
+        self,
+        request: Request[User, Any, Any],
+        data: CreateMusicPlaylistJobs,
+        redis: Redis,
+    ) -> None:
+        return Response(
+            content=None,
+            status_code=status_codes.HTTP_201_CREATED,
+            # Jobs are created as the playlist is expanded, which can take a
+            # while for long playlists.
+            background=BackgroundTask(
+                submit_music_playlist,
+                redis=redis,
+                user_email=request.user.email,
+                playlist_url=data.playlist_url.unicode_string(),
+                artwork_url=data.artwork_url,
+                artist=data.artist,
+                album=data.album,
+                grouping=data.grouping,
+            ),
+        )
+
+    # Both resume after the given event id with the updates that were missed.
+    # If some of them were already trimmed from the log, a reset event is sent
+    # first and the client has to refetch its jobs.
+    @get(path="/listen", status_code=status_codes.HTTP_200_OK)
+    async def listen_jobs(
+        self,
+        request: Request[User, Any, Any],
+        last_event_id_header: Annotated[
+            str | None, Parameter(header="Last-Event-ID", required=False)
+        ] = None,
+        last_event_id: str | None = None,
+    ) -> ServerSentEvent:
+        async def _listen():
+            async with music_job_updates.subscribe(
+                channel=PubSub.get_user_channel(
+                    PubSub.Channels.MUSIC_JOB_UPDATE, request.user.email
+                ),
+                last_id=last_event_id_header or last_event_id,
+            ) as subscription:
+                if subscription.reset:
+                    # Browsers don't dispatch events without data.
+                    yield ServerSentEventMessage(event="reset", data="reset")
+                while True:
+                    try:
+                        event_id, data = await asyncio.wait_for(
+                            subscription.get(),
+                            timeout=settings.pubsub_keepalive_interval,
+                        )
+                        yield ServerSentEventMessage(id=event_id, data=data)
+                    except asyncio.TimeoutError:
+                        # Keeps proxies from closing an idle stream.
+                        yield ServerSentEventMessage(comment="keepalive")
+                    except SubscriptionOverflowError:
+                        # The stream ends, the browser reconnects with the
+                        # last event id and catches up from the log.
+                        return
+
+        return ServerSentEvent(_listen())
+
+    @websocket(path="/listen/ws")
+    async def listen_jobs_ws(
+        self, socket: WebSocket[User, Any, Any], last_event_id: str | None = None
+    ) -> None:
+        await socket.accept()
+        async with music_job_updates.subscribe(
+            channel=PubSub.get_user_channel(
+                PubSub.Channels.MUSIC_JOB_UPDATE, socket.user.email
+            ),
+            last_id=last_event_id,
+        ) as subscription:
+
+            async def _send():
+                if subscription.reset:
+                    await socket.send_json({"event": "reset"})
+                try:
+                    async for event_id, data in subscription:
+                        await socket.send_json(
+                            {"id": event_id, "data": json.loads(data)}
+                        )
+                except SubscriptionOverflowError:
+                    # The client reconnects with the last id it received.
+                    await socket.close(code=status_codes.WS_1013_TRY_AGAIN_LATER)
+
+            async def _receive():
+                # Nothing is expected from the client, receiving only notices
+                # when it disconnects.
+                try:
+                    while True:
+                        await socket.receive_text()
+                except WebSocketDisconnect:
+                    pass
+
+            tasks = {asyncio.create_task(_send()), asyncio.create_task(_receive())}
+            try:
+                await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                for task in tasks:
+                    task.cancel()
+
+    @get(
+        path="/scheduler",
+        status_code=status_codes.HTTP_200_OK,
+        guards=[admin_guard],
+    )
+    async def get_scheduler_stats(self, redis: Redis) -> SchedulerStats:
+        return await music_job_scheduler.get_stats(redis=redis)
+
+    @get(
+        path="/listen/stats",
+        status_code=status_codes.HTTP_200_OK,
+        guards=[admin_guard],
+    )
+    async def get_listen_stats(self) -> PubSubHubStats:
+        return music_job_updates.get_stats()
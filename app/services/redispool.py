@@ -0,0 +1,90 @@
+import logging
+import time
+
+from pydantic import BaseModel
+from redis.asyncio import BlockingConnectionPool, Redis
+
+from app.settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+class RedisPoolStats(BaseModel):
+    max_connections: int
+    in_use: int
+    idle: int
+    waits: int
+    total_wait_time: float
+    max_wait_time: float
+
+
+class InstrumentedConnectionPool(BlockingConnectionPool):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.waits = 0
+        self.total_wait_time = 0.0
+        self.max_wait_time = 0.0
+
+    async def get_connection(self, *args, **kwargs):
+        if self.can_get_connection():
+            return await super().get_connection(*args, **kwargs)
+        start = time.monotonic()
+        connection = await super().get_connection(*args, **kwargs)
+        wait_time = time.monotonic() - start
+        self.waits += 1
+        self.total_wait_time += wait_time
+        self.max_wait_time = max(self.max_wait_time, wait_time)
+        return connection
+
+    def get_stats(self):
+        return RedisPoolStats(
+            max_connections=self.max_connections,
+            in_use=len(self._in_use_connections),
+            idle=len(self._available_connections),
+            waits=self.waits,
+            total_wait_time=self.total_wait_time,
+            max_wait_time=self.max_wait_time,
+        )
+
+
+# One pool per process. The API sizes it from redis_max_connections when it is
+# first used, worker processes replace it with their own size after forking.
+_pool: InstrumentedConnectionPool | None = None
+_client: Redis | None = None
+
+
+def init_pool(max_connections: int = settings.redis_max_connections):
+    global _pool
+    _pool = InstrumentedConnectionPool.from_url(
+        settings.redis_url,
+        max_connections=max_connections,
+        timeout=settings.redis_pool_timeout,
+    )
+    return _pool
+
+
+def get_pool():
+    return _pool or init_pool()
+
+
+def get_client():
+    # One long-lived client per pool. It doesn't own the pool, closing it only
+    # returns its connection.
+    global _client
+    pool = get_pool()
+    if _client is None or _client.connection_pool is not pool:
+        _client = Redis(connection_pool=pool)
+    return _client
+
+
+def get_stats():
+    return get_pool().get_stats()
+
+
+async def close_pool():
+    global _pool, _client
+    if _pool:
+        logger.info(f"Closing redis pool: {_pool.get_stats()}")
+        await _pool.disconnect()
+    _pool = None
+    _client = None
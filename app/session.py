@@ -1,6 +1,8 @@
 from typing import Any
 
 from litestar.connection import ASGIConnection
+from litestar.exceptions import PermissionDeniedException
+from litestar.handlers.base import BaseRouteHandler
 from litestar.middleware.session.server_side import (
     ServerSideSessionBackend,
     ServerSideSessionConfig,
@@ -21,6 +23,11 @@ async def retrieve_user_handler(session: dict[str, Any], connection: ASGIConnect
         )
 
 
+def admin_guard(connection: ASGIConnection[Any, User, Any, Any], _: BaseRouteHandler):
+    if not connection.user.admin:
+        raise PermissionDeniedException()
+
+
 session_auth = SessionAuth[User, ServerSideSessionBackend](
     retrieve_user_handler=retrieve_user_handler,
     session_backend_config=ServerSideSessionConfig(),
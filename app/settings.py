@@ -10,6 +10,16 @@ class ENV(Enum):
     TESTING = "testing"
 
 
+class OverflowPolicy(Enum):
+    # What happens to a subscription whose queue is full when a message comes.
+    DROP_OLDEST = "drop_oldest"
+    # Drops the queued message with the same key as the new one, since the
+    # new one supersedes it, and the oldest message if there is none.
+    COALESCE = "coalesce"
+    # Ends the subscription, the subscriber resumes from its last id.
+    DISCONNECT = "disconnect"
+
+
 class Settings(BaseSettings):
     model_config = SettingsConfigDict(extra="ignore", env_file=".env")
 
@@ -21,10 +31,42 @@ class Settings(BaseSettings):
     aws_s3_artwork_folder: str
     aws_s3_bucket: str
     aws_s3_music_folder: str
+    aws_s3_multipart_chunk_size: int = 8 * 1024 * 1024
+    aws_s3_multipart_concurrency: int = 4
+    aws_s3_multipart_max_retries: int = 3
+    database_max_overflow: int = 5
+    database_pool_pre_ping: bool = True
+    database_pool_recycle: int = 1800
+    database_pool_size: int = 5
+    download_chunk_size: int = 1024 * 1024
+    download_max_retries: int = 3
+    download_timeout: float = 60
     env: ENV = ENV.DEVELOPMENT
+    ffmpeg_slots: int | None = None
+    ffmpeg_threads_per_slot: int = 2
     google_api_key: str
     invidious_api_url: str
+    music_cache_lock_timeout: int = 600
+    music_job_bulk_max_size: int = 100
+    music_job_progress_rate: float = 2
+    music_io_queue: str = "music_io"
+    music_playlist_batch_size: int = 25
+    music_playlist_max_entries: int = 1000
+    music_scheduler_dispatch_interval: float = 60
+    music_scheduler_in_flight_timeout: int = 3600
+    music_scheduler_max_in_flight: int = 10
+    music_scheduler_max_in_flight_per_user: int | None = 5
+    music_scheduler_quantum: float = 1
+    music_transcode_queue: str = "music_transcode"
+    pubsub_keepalive_interval: float = 15
+    pubsub_log_max_length: int = 1000
+    pubsub_log_ttl: int = 86400
+    pubsub_subscriber_overflow_policy: OverflowPolicy = OverflowPolicy.COALESCE
+    pubsub_subscriber_queue_size: int = 100
+    redis_max_connections: int = 50
+    redis_pool_timeout: float = 20
     redis_url: str
+    redis_worker_max_connections: int = 10
     secret_key: str
     sendgrid_api_key: str
     smtp2go_api_key: str
@@ -33,6 +75,11 @@ class Settings(BaseSettings):
     test_redis_url: str
     timeout: int = 600
     timezone: tz | None = tz.utc
+    worker_asyncio: bool = False
+    worker_concurrency: int | None = None
+    worker_executor_threads_per_job: int = 4
+    ytdlp_info_cache_max_size: int = 1024 * 1024
+    ytdlp_info_cache_ttl: int = 1800
 
 
 settings = Settings()
@@ -1,4 +1,6 @@
-from urllib.parse import parse_qs, urlparse
+from urllib.parse import parse_qs, parse_qsl, urlencode, urlparse, urlunparse
+
+YOUTUBE_HOSTS = {"youtube.com", "m.youtube.com", "music.youtube.com", "youtu.be"}
 
 
 def parse_youtube_video_id(url: str):
@@ -6,3 +8,31 @@ def parse_youtube_video_id(url: str):
     search_params = parse_qs(parsed_url.query)
     video_ids = search_params.get("v")
     return video_ids[0] if video_ids else None
+
+
+def get_youtube_video_id(url: str):
+    parsed_url = urlparse(url)
+    host = (parsed_url.hostname or "").lower().removeprefix("www.")
+    if host == "youtu.be":
+        return parsed_url.path.strip("/") or None
+    if host in YOUTUBE_HOSTS:
+        return parse_youtube_video_id(url)
+    return None
+
+
+def get_video_key(url: str):
+    # Only YouTube URLs are keyed by their video id, any other site could use
+    # the same `v` parameter for a different video.
+    if video_id := get_youtube_video_id(url):
+        return f"youtube:{video_id}"
+    parsed_url = urlparse(url)
+    return urlunparse(
+        [
+            parsed_url.scheme.lower(),
+            parsed_url.netloc.lower(),
+            parsed_url.path,
+            parsed_url.params,
+            urlencode(sorted(parse_qsl(parsed_url.query))),
+            "",
+        ]
+    )
@@ -0,0 +1,90 @@
+import mutagen.id3
+
+from app.clients.audiotags import AudioTags
+
+
+def create_audio_tags(path, monkeypatch):
+    # Starts from a file with an empty tag and counts how often it is saved.
+    mutagen.id3.ID3().save(path)
+    audio_tags = AudioTags(file_path=str(path))
+    saves = []
+    save = audio_tags.tags.save
+
+    def _save(*args, **kwargs):
+        saves.append(kwargs)
+        return save(*args, **kwargs)
+
+    monkeypatch.setattr(audio_tags.tags, "save", _save)
+    return audio_tags, saves
+
+
+async def test_audio_tags_apply(tmp_path, monkeypatch):
+    """
+    Test applying tags and artwork to a file. The file should be saved once
+    with all of them and room for later edits.
+    """
+
+    path = tmp_path.joinpath("test.mp3")
+    audio_tags, saves = create_audio_tags(path, monkeypatch)
+    audio_tags.apply(
+        title="title",
+        artist="artist",
+        album="album",
+        grouping="grouping",
+        artwork_data=b"artwork",
+        artwork_mime_type="image/png",
+    )
+    assert len(saves) == 1
+
+    saved_tags = AudioTags(file_path=str(path))
+    assert saved_tags.title == "title"
+    assert saved_tags.artist == "artist"
+    assert saved_tags.album == "album"
+    assert saved_tags.grouping == "grouping"
+    assert saved_tags.artwork.data == b"artwork"
+    assert saved_tags.artwork.mime == "image/png"
+    assert saved_tags.tags.size >= AudioTags._RESERVED_PADDING
+
+
+async def test_audio_tags_apply_partial(tmp_path, monkeypatch):
+    """
+    Test applying only some tags to a file that already has others. The tags
+    that weren't given should be kept.
+    """
+
+    path = tmp_path.joinpath("test.mp3")
+    audio_tags, _ = create_audio_tags(path, monkeypatch)
+    audio_tags.apply(title="title", artist="artist")
+    audio_tags.apply(artist="other")
+
+    saved_tags = AudioTags(file_path=str(path))
+    assert saved_tags.title == "title"
+    assert saved_tags.artist == "other"
+    assert saved_tags.album is None
+    assert saved_tags.artwork is None
+
+
+async def test_audio_tags_batch(tmp_path, monkeypatch):
+    """
+    Test setting tags inside nested batches. The file should only be saved
+    when the outermost batch exits, while setting a tag outside of a batch
+    saves it right away.
+    """
+
+    path = tmp_path.joinpath("test.mp3")
+    audio_tags, saves = create_audio_tags(path, monkeypatch)
+    with audio_tags.batch():
+        audio_tags.title = "title"
+        with audio_tags.batch():
+            audio_tags.album = "album"
+        assert not saves
+        audio_tags.set_artwork(data=b"artwork", mime_type="image/png")
+    assert len(saves) == 1
+
+    audio_tags.artist = "artist"
+    assert len(saves) == 2
+    saved_tags = AudioTags(file_path=str(path))
+    assert saved_tags.title == "title"
+    assert saved_tags.artist == "artist"
+    assert saved_tags.album == "album"
+    assert saved_tags.artwork.data == b"artwork"
@@ -0,0 +1,108 @@
+from functools import partial
+
+import httpx
+import pytest
+
+from app.clients import downloader
+from app.clients.downloader import IncompleteDownloadError
+
+URL = "https://example.com/audio.mp3"
+DATA = bytes(range(100))
+
+
+def mock_client(monkeypatch, handler):
+    # Every request goes to the handler, which sees the ranges asked for.
+    ranges = []
+
+    def _handle(request: httpx.Request):
+        ranges.append(request.headers.get("Range"))
+        return handler(request, len(ranges))
+
+    monkeypatch.setattr(
+        downloader.httpx,
+        "AsyncClient",
+        partial(httpx.AsyncClient, transport=httpx.MockTransport(_handle)),
+    )
+    return ranges
+
+
+def truncated_response():
+    # Announces the whole file but is cut off after 40 bytes.
+    return httpx.Response(
+        status_code=httpx.codes.OK,
+        headers={"Content-Length": str(len(DATA))},
+        content=DATA[:40],
+    )
+
+
+async def download(**kwargs):
+    return b"".join(
+        [
+            chunk
+            async for chunk in downloader.stream_file(url=URL, chunk_size=16, **kwargs)
+        ]
+    )
+
+
+async def test_stream_file_resume(monkeypatch):
+    """
+    Test streaming a file whose response is cut off. The download should be
+    resumed with a Range request from the first missing byte.
+    """
+
+    def handler(request: httpx.Request, attempt: int):
+        if attempt == 1:
+            return truncated_response()
+        return httpx.Response(
+            status_code=httpx.codes.PARTIAL_CONTENT,
+            headers={"Content-Range": f"bytes 40-99/{len(DATA)}"},
+            content=DATA[40:],
+        )
+
+    ranges = mock_client(monkeypatch, handler)
+    assert await download() == DATA
+    assert ranges == [None, "bytes=40-"]
+
+
+async def test_stream_file_resume_ignored(monkeypatch):
+    """
+    Test streaming a file whose response is cut off from a server that ignores
+    Range requests. The bytes that were already received should be skipped
+    when the file is sent again from the start.
+    """
+
+    def handler(request: httpx.Request, attempt: int):
+        if attempt == 1:
+            return truncated_response()
+        return httpx.Response(status_code=httpx.codes.OK, content=DATA)
+
+    ranges = mock_client(monkeypatch, handler)
+    assert await download() == DATA
+    assert ranges == [None, "bytes=40-"]
+
+
+async def test_stream_file_incomplete(monkeypatch):
+    """
+    Test streaming a file whose responses are always shorter than their
+    Content-Length. The download should fail once its retries run out.
+    """
+
+    ranges = mock_client(monkeypatch, lambda request, attempt: truncated_response())
+    with pytest.raises(IncompleteDownloadError):
+        await download(max_retries=1)
+    assert len(ranges) == 2
+
+
+async def test_stream_file_not_found(monkeypatch):
+    """
+    Test streaming a file that doesn't exist. The download should fail without
+    being retried.
+    """
+
+    ranges = mock_client(
+        monkeypatch,
+        lambda request, attempt: httpx.Response(status_code=httpx.codes.NOT_FOUND),
+    )
+    with pytest.raises(httpx.HTTPStatusError):
+        await download()
+    assert len(ranges) == 1
@@ -0,0 +1,90 @@
+import asyncio
+import os
+
+import pytest
+
+from app.clients.ffmpeg import TranscodeScheduler
+
+
+async def test_transcode_scheduler_order(tmp_path):
+    """
+    Test waiting for the slot of a transcode scheduler that is held, with
+    waiters of two schedulers sharing a lock directory. The slot should be
+    handed out in the order the waiters arrived in, whichever scheduler they
+    came through.
+    """
+
+    first = TranscodeScheduler(
+        slots=1, threads=1, lock_directory=tmp_path, poll_interval=0.01
+    )
+    second = TranscodeScheduler(
+        slots=1, threads=1, lock_directory=tmp_path, poll_interval=0.01
+    )
+    order = []
+
+    async def wait(scheduler: TranscodeScheduler, name: str):
+        async with scheduler.slot():
+            order.append(name)
+            await asyncio.sleep(0.05)
+
+    async with first.slot():
+        tasks = []
+        for scheduler, name in [(second, "a"), (first, "b"), (second, "c")]:
+            tasks.append(asyncio.create_task(wait(scheduler, name)))
+            await asyncio.sleep(0.05)
+        assert first.get_stats().queued == 3
+    async with asyncio.timeout(10):
+        await asyncio.gather(*tasks)
+    assert order == ["a", "b", "c"]
+    assert first.get_stats().queued == 0
+    assert first.waits == 2
+    assert second.waits == 2
+
+
+async def test_transcode_scheduler_stale_ticket(tmp_path):
+    """
+    Test waiting for the slot of a transcode scheduler behind a ticket that
+    isn't locked, as left by a process that died. The ticket should be
+    skipped and removed.
+    """
+
+    scheduler = TranscodeScheduler(
+        slots=1, threads=2, lock_directory=tmp_path, poll_interval=0.01
+    )
+    path, fd = scheduler._take_ticket()
+    os.close(fd)
+
+    async with asyncio.timeout(10):
+        async with scheduler.slot() as threads:
+            assert threads == 2
+    assert not path.exists()
+    stats = scheduler.get_stats()
+    assert stats.queued == 0
+    assert stats.waits == 1
+
+
+async def test_transcode_scheduler_cancel(tmp_path):
+    """
+    Test cancelling a waiter for the slot of a transcode scheduler. Its ticket
+    should be removed, and the slot should go to the next waiter once it is
+    released.
+    """
+
+    scheduler = TranscodeScheduler(
+        slots=1, threads=1, lock_directory=tmp_path, poll_interval=0.01
+    )
+
+    async def wait():
+        async with scheduler.slot():
+            pass
+
+    async with scheduler.slot():
+        task = asyncio.create_task(wait())
+        await asyncio.sleep(0.05)
+        assert scheduler.get_stats().queued == 1
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert scheduler.get_stats().queued == 0
+    async with asyncio.timeout(10):
+        await wait()
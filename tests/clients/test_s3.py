@@ -0,0 +1,170 @@
+import io
+
+import pytest
+from botocore.exceptions import ClientError
+
+from app.clients import s3
+
+
+class FakeClient:
+    # Keeps uploads in memory. `fail` decides whether an upload of a part
+    # raises, from its part number and how many times it was already tried.
+    def __init__(self, fail=lambda part_number, attempts: False):
+        self.fail = fail
+        self.objects = {}
+        self.uploads = {}
+        self.attempts = {}
+        self.aborted = []
+
+    def put_object(self, Key: str, Body: bytes, **kwargs):
+        self.objects[Key] = Body
+        return {}
+
+    def create_multipart_upload(self, Key: str, **kwargs):
+        upload_id = str(len(self.uploads) + 1)
+        self.uploads[upload_id] = {}
+        return {"UploadId": upload_id}
+
+    def upload_part(self, UploadId: str, PartNumber: int, Body: bytes, **kwargs):
+        attempts = self.attempts.get(PartNumber, 0)
+        self.attempts[PartNumber] = attempts + 1
+        if self.fail(PartNumber, attempts):
+            raise ClientError(
+                {"Error": {"Code": "InternalError", "Message": "Failed"}},
+                "UploadPart",
+            )
+        self.uploads[UploadId][PartNumber] = Body
+        return {"ETag": str(PartNumber)}
+
+    def complete_multipart_upload(
+        self, Key: str, UploadId: str, MultipartUpload: dict, **kwargs
+    ):
+        parts = self.uploads.pop(UploadId)
+        self.objects[Key] = b"".join(
+            parts[part["PartNumber"]] for part in MultipartUpload["Parts"]
+        )
+        return {}
+
+    def abort_multipart_upload(self, UploadId: str, **kwargs):
+        self.uploads.pop(UploadId)
+        self.aborted.append(UploadId)
+        return {}
+
+
+def get_read(data: bytes):
+    # Reads at most 3 bytes at a time, like a stream that returns short reads.
+    stream = io.BytesIO(data)
+
+    async def _read(size: int):
+        return stream.read(min(size, 3))
+
+    return _read
+
+
+async def test_upload_stream_multipart(monkeypatch):
+    """
+    Test uploading a stream larger than the chunk size. It should be uploaded
+    in full chunks as the parts of a multipart upload, which are put back
+    together in order.
+    """
+
+    client = FakeClient()
+    monkeypatch.setattr(s3, "_client", client)
+    data = bytes(range(256)) * 4
+    await s3.upload_stream(
+        filename="music/test.mp3",
+        read=get_read(data),
+        content_type="audio/mpeg",
+        chunk_size=100,
+        concurrency=3,
+    )
+    assert client.objects == {"music/test.mp3": data}
+    assert sorted(client.attempts) == list(range(1, 12))
+    assert not client.uploads
+
+
+async def test_upload_stream_small(monkeypatch):
+    """
+    Test uploading a stream smaller than the chunk size. It should be uploaded
+    with a single request.
+    """
+
+    client = FakeClient()
+    monkeypatch.setattr(s3, "_client", client)
+    await s3.upload_stream(
+        filename="music/test.mp3",
+        read=get_read(b"small"),
+        content_type="audio/mpeg",
+        chunk_size=100,
+    )
+    assert client.objects == {"music/test.mp3": b"small"}
+    assert not client.attempts
+
+
+async def test_upload_stream_abort(monkeypatch):
+    """
+    Test uploading a stream when uploading one of its parts keeps failing.
+    The multipart upload should be aborted and the error raised.
+    """
+
+    client = FakeClient(fail=lambda part_number, attempts: part_number == 2)
+    monkeypatch.setattr(s3, "_client", client)
+    with pytest.raises(ClientError):
+        await s3.upload_stream(
+            filename="music/test.mp3",
+            read=get_read(bytes(1000)),
+            content_type="audio/mpeg",
+            chunk_size=100,
+            max_retries=0,
+        )
+    assert client.aborted == ["1"]
+    assert not client.uploads
+    assert not client.objects
+
+
+async def test_upload_path_retry(monkeypatch, tmp_path):
+    """
+    Test uploading a file larger than the chunk size when the first upload of
+    every part fails. Each part should be retried on its own and the file
+    uploaded in full.
+    """
+
+    client = FakeClient(fail=lambda part_number, attempts: attempts == 0)
+    monkeypatch.setattr(s3, "_client", client)
+    data = bytes(range(250))
+    path = tmp_path.joinpath("test.mp3")
+    path.write_bytes(data)
+    await s3.upload_path(
+        filename="music/test.mp3",
+        path=str(path),
+        content_type="audio/mpeg",
+        chunk_size=100,
+        max_retries=1,
+    )
+    assert client.objects == {"music/test.mp3": data}
+    assert client.attempts == {1: 2, 2: 2, 3: 2}
+    assert not client.aborted
+
+
+async def test_upload_path_abort(monkeypatch, tmp_path):
+    """
+    Test uploading a file larger than the chunk size when uploading one of its
+    parts fails more than max_retries times. The multipart upload should be
+    aborted and the error raised.
+    """
+
+    client = FakeClient(fail=lambda part_number, attempts: part_number == 3)
+    monkeypatch.setattr(s3, "_client", client)
+    path = tmp_path.joinpath("test.mp3")
+    path.write_bytes(bytes(250))
+    with pytest.raises(ClientError):
+        await s3.upload_path(
+            filename="music/test.mp3",
+            path=str(path),
+            content_type="audio/mpeg",
+            chunk_size=100,
+            max_retries=1,
+        )
+    assert client.attempts[3] == 2
+    assert client.aborted == ["1"]
+    assert not client.objects
@@ -0,0 +1,126 @@
+import json
+import zlib
+
+import pytest
+import yt_dlp
+
+from app.clients import ytdlp
+
+URL = "https://www.youtube.com/watch?v=C0DPdy98e4c"
+SHORT_URL = "https://youtu.be/C0DPdy98e4c"
+INFO = {"id": "C0DPdy98e4c", "title": "title", "ext": "webm"}
+
+
+class FakeYoutubeDL:
+    # Records extractions and reuses of cached info instead of going online.
+    extracted = []
+    processed = []
+    stale = False
+
+    def __init__(self, params: dict | None = None):
+        self.params = params or {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def extract_info(self, url: str, download: bool = True):
+        self.extracted.append((url, download))
+        return dict(INFO)
+
+    def sanitize_info(self, info: dict):
+        return info
+
+    def process_ie_result(self, info: dict, download: bool = True):
+        self.processed.append(info)
+        if self.stale:
+            raise yt_dlp.utils.DownloadError("Stale")
+        return info
+
+    def prepare_filename(self, info: dict):
+        return self.params["outtmpl"].replace("%(ext)s", info["ext"])
+
+
+@pytest.fixture(scope="function")
+async def youtube_dl(monkeypatch):
+    monkeypatch.setattr(FakeYoutubeDL, "extracted", [])
+    monkeypatch.setattr(FakeYoutubeDL, "processed", [])
+    monkeypatch.setattr(ytdlp.yt_dlp, "YoutubeDL", FakeYoutubeDL)
+    return FakeYoutubeDL
+
+
+async def test_extract_video_info_cached(youtube_dl, redis):
+    """
+    Test extracting the info of a video twice through different URLs of it.
+    The info should only be extracted once, and cached compressed for the
+    info cache TTL.
+    """
+
+    assert await ytdlp.extract_video_info(url=URL, redis=redis) == INFO
+    assert await ytdlp.extract_video_info(url=SHORT_URL, redis=redis) == INFO
+    assert youtube_dl.extracted == [(URL, False)]
+
+    key = ytdlp._get_info_cache_key(URL)
+    assert json.loads(zlib.decompress(await redis.get(key))) == INFO
+    assert 0 < await redis.ttl(key) <= ytdlp.settings.ytdlp_info_cache_ttl
+
+
+async def test_extract_video_info_too_large(youtube_dl, redis, monkeypatch):
+    """
+    Test extracting the info of a video that is larger than the info cache
+    allows. The info should not be cached and be extracted every time.
+    """
+
+    monkeypatch.setattr(ytdlp.settings, "ytdlp_info_cache_max_size", 1)
+    await ytdlp.extract_video_info(url=URL, redis=redis)
+    await ytdlp.extract_video_info(url=URL, redis=redis)
+    assert len(youtube_dl.extracted) == 2
+    assert not await redis.exists(ytdlp._get_info_cache_key(URL))
+
+
+async def test_extract_video_info_corrupt(youtube_dl, redis):
+    """
+    Test extracting the info of a video whose cached info is corrupt. The info
+    should be extracted again and replace it.
+    """
+
+    key = ytdlp._get_info_cache_key(URL)
+    await redis.set(key, b"corrupt")
+    assert await ytdlp.extract_video_info(url=URL, redis=redis) == INFO
+    assert youtube_dl.extracted == [(URL, False)]
+    assert json.loads(zlib.decompress(await redis.get(key))) == INFO
+
+
+async def test_download_audio_from_video_cached(youtube_dl, redis, tmp_path):
+    """
+    Test downloading the audio of a video whose info is cached. The cached
+    info should be processed instead of extracting it again.
+    """
+
+    await ytdlp.extract_video_info(url=URL, redis=redis)
+    path = await ytdlp.download_audio_from_video(
+        download_path=str(tmp_path.joinpath("audio")), url=SHORT_URL, redis=redis
+    )
+    assert path == str(tmp_path.joinpath("audio.webm"))
+    assert youtube_dl.processed == [INFO]
+    assert youtube_dl.extracted == [(URL, False)]
+
+
+async def test_download_audio_from_video_stale(
+    youtube_dl, redis, tmp_path, monkeypatch
+):
+    """
+    Test downloading the audio of a video whose cached info is stale. The
+    video should be extracted again and downloaded.
+    """
+
+    await ytdlp.extract_video_info(url=URL, redis=redis)
+    monkeypatch.setattr(youtube_dl, "stale", True)
+    path = await ytdlp.download_audio_from_video(
+        download_path=str(tmp_path.joinpath("audio")), url=URL, redis=redis
+    )
+    assert path == str(tmp_path.joinpath("audio.webm"))
+    assert youtube_dl.processed == [INFO]
+    assert youtube_dl.extracted == [(URL, False), (URL, True)]
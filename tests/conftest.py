@@ -1,3 +1,5 @@
+from typing import Callable
+
 import httpx
 import pytest
 from faker import Faker
@@ -12,6 +14,7 @@ from app.db import sqlalchemy_config
 from app.db.models.musicjob import MusicJob, provide_music_jobs_repo
 from app.db.models.users import User, provide_users_repo
 from app.pubsub import PubSub
+from app.queue.music import music_job_scheduler
 from app.services import tempfiles
 from app.settings import ENV, settings
 
@@ -62,9 +65,34 @@ async def redis():
     await redis.aclose()
 
 
+@pytest.fixture(scope="function")
+async def sent_job_ids():
+    return []
+
+
+@pytest.fixture(scope="function")
+async def send_job_ids(sent_job_ids):
+    # Stands in for sending jobs to celery, recording their IDs instead.
+    async def _run(job_ids: list[str]):
+        sent_job_ids.extend(job_ids)
+
+    return _run
+
+
+@pytest.fixture(scope="function")
+async def mock_music_job_scheduler(send_job_ids, monkeypatch):
+    monkeypatch.setattr(music_job_scheduler, "send", send_job_ids)
+    return music_job_scheduler
+
+
 @pytest.fixture(scope="function")
 async def get_pubsub_channel_messages():
-    async def _run(channel: str, max_num_messages: int, timeout: int = 60):
+    async def _run(
+        channel: str,
+        max_num_messages: int,
+        timeout: int = 60,
+        until: Callable[[dict], bool] | None = None,
+    ):
         pubsub = PubSub(channels=[channel])
         messages = []
         async for message in pubsub.listen(
@@ -73,7 +101,9 @@ async def get_pubsub_channel_messages():
             if not message:
                 pubsub.stop_listening()
             messages.append(message)
-            if len(messages) == max_num_messages:
+            if len(messages) == max_num_messages or (
+                message and until and until(message)
+            ):
                 pubsub.stop_listening()
         return messages
 
@@ -1,15 +1,57 @@
+import asyncio
 import json
+from types import SimpleNamespace
 
 import httpx
 import pytest
 from advanced_alchemy.exceptions import NotFoundError
 from litestar.datastructures import UploadFile
 
-from app.clients import audiotags
-from app.db.models.musicjob import MusicJob
+from app.clients import audiotags, s3
+from app.db.models.musicjob import MusicJob, MusicJobRespository, MusicJobStage
 from app.db.models.users import User
 from app.pubsub import PubSub
-from app.queue.music import run_music_job
+from app.queue.music import (
+    MusicJobSourceNotFoundError,
+    dispatch_music_jobs,
+    fetch_music_job,
+    get_stage_filename,
+    get_video_cache_filename,
+    music_job_scheduler,
+    on_failed_music_job,
+    submit_music_job,
+    submit_music_playlist,
+    tag_music_job,
+    transcode_music_job,
+    upload_music_job,
+)
+from app.queue.scheduler import Lanes
+
+
+async def run_music_job(music_job_id: str):
+    # Runs the stages in the order of the pipeline chain.
+    for stage in [
+        fetch_music_job,
+        transcode_music_job,
+        tag_music_job,
+        upload_music_job,
+    ]:
+        await stage(music_job_id=music_job_id)
+
+
+async def test_get_video_cache_filename():
+    """
+    Test getting the cache filename of videos. YouTube URLs of the same video
+    should share a filename, other sites with the same `v` parameter shouldn't.
+    """
+
+    filename = get_video_cache_filename("https://www.youtube.com/watch?v=abc&t=10")
+    assert get_video_cache_filename("https://youtu.be/abc") == filename
+    assert get_video_cache_filename("https://music.youtube.com/watch?v=abc") == filename
+    assert (
+        get_video_cache_filename("https://vimeo.example.com/watch?v=abc&x=1")
+        != filename
+    )
 
 
 async def test_run_music_job_with_non_existent_job(faker):
@@ -33,7 +75,7 @@ async def test_run_music_job_with_non_existent_file(create_user, create_music_jo
         email=user.email,
     )
 
-    with pytest.raises(Exception, match="File not found"):
+    with pytest.raises(MusicJobSourceNotFoundError):
         await run_music_job(music_job_id=str(music_job.id))
 
 
@@ -45,7 +87,8 @@ async def test_run_music_job_messages(
 ):
     """
     Test running a music job with correct parameters. The music job
-    should properly send messages to the music job redis channel.
+    should properly send messages to the music job redis channel, with
+    throttled progress messages between the start and the end.
     """
 
     user: User = await create_user()
@@ -53,23 +96,25 @@ async def test_run_music_job_messages(
         email=user.email, video_url=test_video_url
     )
 
-    task = run_music_job(music_job_id=str(music_job.id))
+    task = asyncio.create_task(run_music_job(music_job_id=str(music_job.id)))
 
     pubsub_messages = await get_pubsub_channel_messages(
-        PubSub.Channels.MUSIC_JOB_UPDATE, max_num_messages=2
+        PubSub.get_user_channel(PubSub.Channels.MUSIC_JOB_UPDATE, user.email),
+        max_num_messages=1000,
+        until=lambda message: json.loads(message["data"])["status"] == "COMPLETED",
     )
 
     await task
 
-    assert len(pubsub_messages) == 2
-    assert json.loads(pubsub_messages[0]["data"]) == {
-        "id": str(music_job.id),
-        "status": "STARTED",
-    }
-    assert json.loads(pubsub_messages[1]["data"]) == {
-        "id": str(music_job.id),
-        "status": "COMPLETED",
-    }
+    messages = [json.loads(message["data"]) for message in pubsub_messages]
+    assert messages[0] == {"id": str(music_job.id), "status": "STARTED"}
+    assert messages[-1] == {"id": str(music_job.id), "status": "COMPLETED"}
+    for message in messages[1:-1]:
+        assert message["id"] == str(music_job.id)
+        assert message["status"] == "PROGRESS"
+        assert message["stage"] in ["fetch", "transcode", "tag"]
+        if "progress" in message:
+            assert 0 <= message["progress"] <= 100
 
 
 async def test_run_music_job_with_audio_url(
@@ -104,6 +149,9 @@ async def test_run_music_job_with_audio_url(
     assert music_job.completed is not None
     assert music_job.download_url is not None
     assert music_job.download_filename is not None
+    assert not await s3.file_exists(
+        filename=get_stage_filename(music_job=music_job, name="tagged.mp3")
+    )
 
     async with httpx.AsyncClient() as client:
         response = await client.get(music_job.download_url)
@@ -152,6 +200,8 @@ async def test_run_music_job_with_file(
     assert music_job.completed is not None
     assert music_job.filename_url is not None
     assert music_job.original_filename is not None
+    assert music_job.source_codec == "mp3"
+    assert music_job.transcode_action == "copy"
 
     async with httpx.AsyncClient() as client:
         response = await client.get(music_job.download_url)
@@ -217,3 +267,427 @@ async def test_run_music_job_with_external_artwork(
         assert tags.artwork_url == audiotags.AudioTags.get_image_as_base64(
             test_image, "image/png"
         )
+
+
+async def test_run_music_job_with_cached_video_url(
+    create_user,
+    create_music_job,
+    db_session,
+    test_audio_url,
+):
+    """
+    Test running two music jobs with the same video url. Both jobs should
+    finish successfully with their own tag values and share one cached master.
+    """
+
+    user: User = await create_user()
+    first_music_job: MusicJob = await create_music_job(
+        email=user.email, video_url=test_audio_url
+    )
+    second_music_job: MusicJob = await create_music_job(
+        email=user.email, video_url=test_audio_url
+    )
+
+    await run_music_job(music_job_id=str(first_music_job.id))
+    await run_music_job(music_job_id=str(second_music_job.id))
+
+    master_filename = get_video_cache_filename(test_audio_url)
+    assert await s3.file_exists(filename=master_filename)
+
+    await db_session.refresh(second_music_job)
+    assert second_music_job.transcode_action == "cached"
+
+    for music_job in [first_music_job, second_music_job]:
+        expected_title = music_job.title
+        await db_session.refresh(music_job)
+        assert music_job.completed is not None
+
+        async with httpx.AsyncClient() as client:
+            response = await client.get(music_job.download_url)
+            assert response.status_code == 200
+            tags = await audiotags.AudioTags.read_tags(
+                file=response.content, filename="test.mp3"
+            )
+            assert tags.title == expected_title
+
+
+async def test_run_music_job_resumes_from_last_stage(
+    create_user,
+    create_music_job,
+    db_session,
+    test_audio_url,
+    monkeypatch,
+):
+    """
+    Test running a music job again after its fetch stage completed. The job
+    should resume from the checkpointed source instead of fetching it again.
+    """
+
+    user: User = await create_user()
+    music_job: MusicJob = await create_music_job(
+        email=user.email, video_url=test_audio_url
+    )
+    assert music_job.stage == MusicJobStage.UPLOADED
+
+    await fetch_music_job(music_job_id=str(music_job.id))
+    await db_session.refresh(music_job)
+    assert music_job.stage == MusicJobStage.FETCHED
+    assert await s3.file_exists(filename=music_job.source_filename)
+
+    async def fail_retrieve_audio_source(**kwargs):
+        raise Exception("Fetched again")
+
+    monkeypatch.setattr(
+        "app.queue.music.retrieve_audio_source", fail_retrieve_audio_source
+    )
+    await run_music_job(music_job_id=str(music_job.id))
+
+    await db_session.refresh(music_job)
+    assert music_job.stage == MusicJobStage.STORED
+    assert music_job.completed is not None
+    assert music_job.audio_filename is not None
+    assert music_job.tagged_filename is not None
+
+
+async def test_on_failed_music_job(
+    create_user,
+    create_music_job,
+    db_session,
+    test_audio_url,
+    get_pubsub_channel_messages,
+):
+    """
+    Test handling a terminal failure of a music job. The job should be marked
+    as failed with the error, its stage files should be deleted and a FAILED
+    message should be sent to the music job redis channel.
+    """
+
+    user: User = await create_user()
+    music_job: MusicJob = await create_music_job(
+        email=user.email, video_url=test_audio_url
+    )
+    await fetch_music_job(music_job_id=str(music_job.id))
+    await transcode_music_job(music_job_id=str(music_job.id))
+    await tag_music_job(music_job_id=str(music_job.id))
+    await db_session.refresh(music_job)
+    assert await s3.file_exists(filename=music_job.tagged_filename)
+    tagged_filename = music_job.tagged_filename
+
+    task = asyncio.create_task(
+        on_failed_music_job(
+            SimpleNamespace(kwargs={"music_job_id": str(music_job.id)}),
+            Exception("Upload failed"),
+            None,
+        )
+    )
+    pubsub_messages = await get_pubsub_channel_messages(
+        PubSub.get_user_channel(PubSub.Channels.MUSIC_JOB_UPDATE, user.email),
+        max_num_messages=1,
+    )
+    await task
+
+    assert json.loads(pubsub_messages[0]["data"]) == {
+        "id": str(music_job.id),
+        "status": "FAILED",
+        "error": "Upload failed",
+    }
+    await db_session.refresh(music_job)
+    assert music_job.failed is not None
+    assert music_job.error == "Upload failed"
+    assert music_job.stage == MusicJobStage.FETCHED
+    assert music_job.tagged_filename is None
+    assert not await s3.file_exists(filename=tagged_filename)
+
+
+async def test_on_failed_music_job_before_transcode(
+    create_user, create_music_job, db_session, test_audio_url
+):
+    """
+    Test handling a terminal failure of a music job from a video that was
+    fetched but not transcoded. The downloaded source should be deleted and
+    the job should be fetched again by a later run.
+    """
+
+    user: User = await create_user()
+    music_job: MusicJob = await create_music_job(
+        email=user.email, video_url=test_audio_url
+    )
+    await fetch_music_job(music_job_id=str(music_job.id))
+    await db_session.refresh(music_job)
+    source_filename = get_video_cache_filename(
+        video_url=test_audio_url, extension="source"
+    )
+    assert music_job.source_filename == source_filename
+    assert await s3.file_exists(filename=source_filename)
+
+    await on_failed_music_job(
+        SimpleNamespace(kwargs={"music_job_id": str(music_job.id)}),
+        Exception("Transcode failed"),
+        None,
+    )
+    await db_session.refresh(music_job)
+    assert music_job.failed is not None
+    assert music_job.stage == MusicJobStage.UPLOADED
+    assert music_job.source_filename is None
+    assert not await s3.file_exists(filename=source_filename)
+
+
+async def test_submit_music_job_failed_upload(
+    create_user,
+    db_session,
+    redis,
+    get_pubsub_channel_messages,
+    monkeypatch,
+    mock_music_job_scheduler,
+    sent_job_ids,
+):
+    """
+    Test submitting a music job whose files fail to upload. The job should be
+    marked as failed with the error instead of being scheduled, and a FAILED
+    message should be sent to the music job redis channel.
+    """
+
+    user: User = await create_user()
+    channel = PubSub.get_user_channel(PubSub.Channels.MUSIC_JOB_UPDATE, user.email)
+    music_jobs_repo = MusicJobRespository(session=db_session, auto_commit=True)
+    music_job = await music_jobs_repo.add(
+        MusicJob(
+            user_email=user.email,
+            title="title",
+            artist="artist",
+            album="album",
+        )
+    )
+
+    async def upload_files(self, file=None, artwork_url=None):
+        raise Exception("Upload failed")
+
+    monkeypatch.setattr(MusicJob, "upload_files", upload_files)
+    task = asyncio.create_task(
+        submit_music_job(
+            redis=redis,
+            music_job=music_job,
+            file=UploadFile(content_type="audio/mpeg", filename="test.mp3"),
+        )
+    )
+    pubsub_messages = await get_pubsub_channel_messages(channel, max_num_messages=1)
+    await task
+
+    assert json.loads(pubsub_messages[0]["data"]) == {
+        "id": str(music_job.id),
+        "status": "FAILED",
+        "error": "Upload failed",
+    }
+    await db_session.refresh(music_job)
+    assert music_job.failed is not None
+    assert music_job.error == "Upload failed"
+    assert music_job.stage is None
+    assert sent_job_ids == []
+
+
+async def test_submit_music_job_failed_schedule(
+    create_user, db_session, redis, get_pubsub_channel_messages, monkeypatch
+):
+    """
+    Test submitting a music job that fails to be scheduled after it was
+    uploaded. The job should be marked as failed with the error, and a FAILED
+    message should be sent to the music job redis channel.
+    """
+
+    user: User = await create_user()
+    channel = PubSub.get_user_channel(PubSub.Channels.MUSIC_JOB_UPDATE, user.email)
+    music_jobs_repo = MusicJobRespository(session=db_session, auto_commit=True)
+    music_job = await music_jobs_repo.add(
+        MusicJob(
+            user_email=user.email,
+            title="title",
+            artist="artist",
+            album="album",
+        )
+    )
+
+    async def schedule_many(**kwargs):
+        raise Exception("Schedule failed")
+
+    monkeypatch.setattr(music_job_scheduler, "schedule_many", schedule_many)
+    task = asyncio.create_task(submit_music_job(redis=redis, music_job=music_job))
+    pubsub_messages = await get_pubsub_channel_messages(channel, max_num_messages=1)
+    await task
+
+    assert json.loads(pubsub_messages[0]["data"]) == {
+        "id": str(music_job.id),
+        "status": "FAILED",
+        "error": "Schedule failed",
+    }
+    await db_session.refresh(music_job)
+    assert music_job.failed is not None
+    assert music_job.error == "Schedule failed"
+    assert music_job.stage == MusicJobStage.UPLOADED
+
+
+async def test_submit_music_playlist(
+    create_user, db_session, redis, monkeypatch, mock_music_job_scheduler, sent_job_ids
+):
+    """
+    Test submitting a playlist. A job should be created and scheduled for
+    every available entry, tagged with the playlist's artist and title.
+    """
+
+    user: User = await create_user()
+    playlist = {"title": "album", "uploader": "artist - Topic"}
+
+    async def iter_playlist_entries(url: str):
+        for i in range(3):
+            yield (
+                playlist,
+                {
+                    "id": str(i),
+                    "title": f"title {i}",
+                    "url": f"https://www.youtube.com/watch?v={i}",
+                },
+            )
+
+    monkeypatch.setattr(
+        "app.queue.music.ytdlp.iter_playlist_entries", iter_playlist_entries
+    )
+    monkeypatch.setattr("app.queue.music.settings.music_playlist_batch_size", 2)
+    await submit_music_playlist(
+        redis=redis,
+        user_email=user.email,
+        playlist_url="https://www.youtube.com/playlist?list=test",
+        grouping="grouping",
+    )
+
+    music_jobs_repo = MusicJobRespository(session=db_session)
+    music_jobs = sorted(await music_jobs_repo.list(), key=lambda job: job.title)
+    assert [music_job.title for music_job in music_jobs] == [
+        "title 0",
+        "title 1",
+        "title 2",
+    ]
+    for music_job in music_jobs:
+        assert music_job.artist == "artist"
+        assert music_job.album == "album"
+        assert music_job.grouping == "grouping"
+        assert music_job.stage == MusicJobStage.UPLOADED
+    assert sorted(sent_job_ids) == sorted(str(music_job.id) for music_job in music_jobs)
+
+
+async def test_submit_music_playlist_failed(
+    create_user,
+    db_session,
+    redis,
+    get_pubsub_channel_messages,
+    monkeypatch,
+    mock_music_job_scheduler,
+    sent_job_ids,
+):
+    """
+    Test submitting a playlist whose extraction fails after its first entry.
+    The job of the first entry should be scheduled, and a FAILED message for
+    the playlist should be sent to the music job redis channel.
+    """
+
+    user: User = await create_user()
+    channel = PubSub.get_user_channel(PubSub.Channels.MUSIC_JOB_UPDATE, user.email)
+    playlist_url = "https://www.youtube.com/playlist?list=test"
+
+    async def iter_playlist_entries(url: str):
+        yield (
+            {"title": "album", "uploader": "artist"},
+            {"id": "0", "title": "title", "url": "https://www.youtube.com/watch?v=0"},
+        )
+        raise Exception("Extraction failed")
+
+    monkeypatch.setattr(
+        "app.queue.music.ytdlp.iter_playlist_entries", iter_playlist_entries
+    )
+    monkeypatch.setattr("app.queue.music.settings.music_playlist_batch_size", 1)
+    task = asyncio.create_task(
+        submit_music_playlist(
+            redis=redis, user_email=user.email, playlist_url=playlist_url
+        )
+    )
+    pubsub_messages = await get_pubsub_channel_messages(channel, max_num_messages=1)
+    await task
+
+    assert json.loads(pubsub_messages[0]["data"]) == {
+        "id": playlist_url,
+        "status": "FAILED",
+        "error": "Extraction failed",
+    }
+    (music_job,) = await MusicJobRespository(session=db_session).list()
+    assert music_job.failed is None
+    assert sent_job_ids == [str(music_job.id)]
+
+
+async def test_submit_music_playlist_failed_schedule(
+    create_user, db_session, redis, get_pubsub_channel_messages, monkeypatch
+):
+    """
+    Test submitting a playlist whose jobs fail to be scheduled after they were
+    inserted. The jobs should be marked as failed with the error, and a
+    FAILED message should be sent for each of them.
+    """
+
+    user: User = await create_user()
+    channel = PubSub.get_user_channel(PubSub.Channels.MUSIC_JOB_UPDATE, user.email)
+
+    async def iter_playlist_entries(url: str):
+        for i in range(2):
+            yield (
+                {"title": "album", "uploader": "artist"},
+                {
+                    "id": str(i),
+                    "title": f"title {i}",
+                    "url": f"https://www.youtube.com/watch?v={i}",
+                },
+            )
+
+    async def schedule_many(**kwargs):
+        raise Exception("Schedule failed")
+
+    monkeypatch.setattr(
+        "app.queue.music.ytdlp.iter_playlist_entries", iter_playlist_entries
+    )
+    monkeypatch.setattr(music_job_scheduler, "schedule_many", schedule_many)
+    task = asyncio.create_task(
+        submit_music_playlist(
+            redis=redis,
+            user_email=user.email,
+            playlist_url="https://www.youtube.com/playlist?list=test",
+        )
+    )
+    pubsub_messages = await get_pubsub_channel_messages(channel, max_num_messages=2)
+    await task
+
+    music_jobs = await MusicJobRespository(session=db_session).list()
+    assert len(music_jobs) == 2
+    for music_job in music_jobs:
+        assert music_job.failed is not None
+        assert music_job.error == "Schedule failed"
+    assert sorted(
+        json.loads(message["data"])["id"] for message in pubsub_messages
+    ) == sorted(str(music_job.id) for music_job in music_jobs)
+
+
+async def test_dispatch_music_jobs(
+    redis, monkeypatch, mock_music_job_scheduler, sent_job_ids
+):
+    """
+    Test dispatching music jobs after a job in flight was never released. The
+    pending job should be sent once the released job expires.
+    """
+
+    monkeypatch.setattr(music_job_scheduler, "max_in_flight", 1)
+    await music_job_scheduler.schedule_many(
+        redis=redis, job_ids=["a0", "a1"], user="a", lane=Lanes.DEFAULT
+    )
+    assert sent_job_ids == ["a0"]
+
+    await dispatch_music_jobs()
+    assert sent_job_ids == ["a0"]
+
+    monkeypatch.setattr(music_job_scheduler, "in_flight_timeout", 0)
+    await dispatch_music_jobs()
+    assert sent_job_ids == ["a0", "a1"]
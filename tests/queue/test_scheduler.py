@@ -0,0 +1,117 @@
+import pytest
+
+from app.queue.scheduler import FairScheduler, Lanes
+
+
+async def test_scheduler_round_robin_between_users(redis, send_job_ids, sent_job_ids):
+    """
+    Test scheduling a batch of jobs for one user followed by jobs for other
+    users. The jobs should be dispatched alternating between users, with the
+    priority lane served first.
+    """
+
+    scheduler = FairScheduler(name="test", send=send_job_ids, max_in_flight=0)
+    for i in range(3):
+        await scheduler.schedule(
+            redis=redis, job_id=f"a{i}", user="a", lane=Lanes.DEFAULT
+        )
+    for i in range(2):
+        await scheduler.schedule(
+            redis=redis, job_id=f"b{i}", user="b", lane=Lanes.DEFAULT
+        )
+    await scheduler.schedule(redis=redis, job_id="c0", user="c", lane=Lanes.PRIORITY)
+    assert sent_job_ids == []
+
+    scheduler.max_in_flight = 10
+    await scheduler.dispatch(redis=redis)
+    assert sent_job_ids == ["c0", "a0", "b0", "a1", "b1", "a2"]
+
+
+async def test_scheduler_max_in_flight(redis, send_job_ids, sent_job_ids):
+    """
+    Test scheduling more jobs than can be in flight. Only max_in_flight jobs
+    should be dispatched until a running job is released, and the wait times
+    should be recorded per user.
+    """
+
+    scheduler = FairScheduler(name="test", send=send_job_ids, max_in_flight=2)
+    for i in range(3):
+        await scheduler.schedule(
+            redis=redis, job_id=f"a{i}", user="a", lane=Lanes.DEFAULT
+        )
+    assert sent_job_ids == ["a0", "a1"]
+
+    stats = await scheduler.get_stats(redis=redis)
+    assert stats.in_flight == 2
+    assert len(stats.users) == 1
+    assert stats.users[0].user == "a"
+    assert stats.users[0].pending == 1
+    assert stats.users[0].dispatched == 2
+
+    await scheduler.release(redis=redis, job_id="a0")
+    assert sent_job_ids == ["a0", "a1", "a2"]
+
+
+async def test_scheduler_max_in_flight_per_user(redis, send_job_ids, sent_job_ids):
+    """
+    Test scheduling a batch of jobs for one user with a per user cap. The user
+    should only hold the capped number of slots while other users' jobs are
+    still dispatched.
+    """
+
+    scheduler = FairScheduler(
+        name="test", send=send_job_ids, max_in_flight=10, max_in_flight_per_user=2
+    )
+    await scheduler.schedule_many(
+        redis=redis,
+        job_ids=[f"a{i}" for i in range(4)],
+        user="a",
+        lane=Lanes.DEFAULT,
+    )
+    assert sent_job_ids == ["a0", "a1"]
+
+    await scheduler.schedule(redis=redis, job_id="b0", user="b", lane=Lanes.DEFAULT)
+    assert sent_job_ids == ["a0", "a1", "b0"]
+
+    await scheduler.release(redis=redis, job_id="a0")
+    assert sent_job_ids == ["a0", "a1", "b0", "a2"]
+
+    stats = await scheduler.get_stats(redis=redis)
+    assert stats.in_flight == 3
+    assert stats.users[0].user == "a"
+    assert stats.users[0].in_flight == 2
+    assert stats.users[0].pending == 1
+
+
+async def test_scheduler_send_failed(redis, send_job_ids, sent_job_ids):
+    """
+    Test dispatching jobs of two users when sending them fails. The jobs
+    should keep their place and be sent in the same order by the next
+    dispatch.
+    """
+
+    failures = [Exception("Send failed")]
+
+    async def send(job_ids: list[str]):
+        if failures:
+            raise failures.pop()
+        await send_job_ids(job_ids)
+
+    scheduler = FairScheduler(name="test", send=send, max_in_flight=0)
+    await scheduler.schedule_many(
+        redis=redis, job_ids=["a0", "a1", "a2"], user="a", lane=Lanes.DEFAULT
+    )
+    await scheduler.schedule(redis=redis, job_id="b0", user="b", lane=Lanes.DEFAULT)
+
+    scheduler.max_in_flight = 3
+    with pytest.raises(Exception, match="Send failed"):
+        await scheduler.dispatch(redis=redis)
+    assert sent_job_ids == []
+    stats = await scheduler.get_stats(redis=redis)
+    assert stats.in_flight == 0
+    assert [user.pending for user in stats.users] == [3, 1]
+
+    await scheduler.dispatch(redis=redis)
+    assert sent_job_ids == ["a0", "b0", "a1"]
+    await scheduler.release(redis=redis, job_id="a0")
+    assert sent_job_ids == ["a0", "b0", "a1", "a2"]
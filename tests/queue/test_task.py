@@ -0,0 +1,183 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from celery.signals import worker_process_shutdown
+from sqlalchemy import text
+
+from app.queue.app import celery
+from app.queue.task import QueueTask, RetryPolicy
+
+
+class TransientError(Exception):
+    pass
+
+
+class CountdownRetryPolicy(RetryPolicy):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.countdowns = []
+
+    def get_countdown(self, retries: int):
+        countdown = super().get_countdown(retries)
+        self.countdowns.append((retries, countdown))
+        return countdown
+
+
+transient_policy = CountdownRetryPolicy(
+    errors=(TransientError,),
+    max_retries=2,
+    base_delay=1,
+    max_delay=10,
+    when=lambda error: str(error) != "permanent",
+)
+runs = []
+failures = []
+
+
+@celery.task(bind=True, retry_policies=[transient_policy])
+async def flaky_task(self: QueueTask, error: str):
+    runs.append(self.request.retries)
+    raise TransientError(error)
+
+
+@celery.task
+async def on_failed_flaky_task(request, exc, traceback):
+    failures.append((request.retries, exc))
+
+
+events: dict[str, asyncio.Event] = {}
+
+
+@celery.task
+async def wait_for_other_task(name: str, other: str):
+    events[name].set()
+    await events[other].wait()
+    return threading.current_thread().name
+
+
+@celery.task
+async def failing_task():
+    raise ValueError("failed")
+
+
+async def test_retry_policy_matches():
+    """
+    Test matching errors against a retry policy. Only errors of its types for
+    which its condition holds should match.
+    """
+
+    assert transient_policy.matches(TransientError("timeout"))
+    assert not transient_policy.matches(TransientError("permanent"))
+    assert not transient_policy.matches(Exception("timeout"))
+
+
+async def test_retry_policy_countdown():
+    """
+    Test the countdowns of a retry policy. Each should be between half and
+    all of the exponential delay of its retry, which is capped at max_delay.
+    """
+
+    policy = RetryPolicy(
+        errors=(TransientError,), max_retries=10, base_delay=1, max_delay=10
+    )
+    for retries in range(10):
+        delay = min(10, 2**retries)
+        for _ in range(100):
+            assert delay / 2 <= policy.get_countdown(retries) <= delay
+
+
+def test_queue_task_retry():
+    """
+    Test running a task that keeps failing with a transient error. It should
+    be retried max_retries times with the policy's countdowns, then fail with
+    the original error, which is handed to its errback.
+    """
+
+    runs.clear()
+    failures.clear()
+    transient_policy.countdowns.clear()
+    result = flaky_task.apply(
+        kwargs={"error": "timeout"}, link_error=on_failed_flaky_task.s()
+    )
+    assert result.state == "FAILURE"
+    assert isinstance(result.result, TransientError)
+    assert runs == [0, 1, 2]
+    assert [retries for retries, _ in transient_policy.countdowns] == [0, 1, 2]
+    for retries, countdown in transient_policy.countdowns:
+        assert 2**retries / 2 <= countdown <= 2**retries
+    assert len(failures) == 1
+    assert failures[0][0] == 2
+    assert str(failures[0][1]) == "timeout"
+
+
+def test_queue_task_no_retry():
+    """
+    Test running a task that fails with an error no policy matches. It should
+    fail without being retried.
+    """
+
+    runs.clear()
+    failures.clear()
+    result = flaky_task.apply(
+        kwargs={"error": "permanent"}, link_error=on_failed_flaky_task.s()
+    )
+    assert result.state == "FAILURE"
+    assert runs == [0]
+    assert len(failures) == 1
+
+
+def test_queue_task_engine():
+    """
+    Test opening sessions from tasks in a worker process. Every session should
+    use one shared engine, which is disposed of when the worker process shuts
+    down.
+    """
+
+    async def get_engine():
+        async with QueueTask.get_sessionmaker()() as session:
+            await session.execute(text("SELECT 1"))
+            return session.bind
+
+    engine = QueueTask.run_coroutine(get_engine())
+    assert QueueTask.run_coroutine(get_engine()) is engine
+    pool = engine.sync_engine.pool
+    worker_process_shutdown.send(sender=None)
+    assert QueueTask._engine is None
+    # Disposing replaces the engine's pool.
+    assert engine.sync_engine.pool is not pool
+
+
+def test_queue_task_shared_loop(monkeypatch):
+    """
+    Test running tasks from two worker threads with the shared loop. Both
+    should run concurrently on the loop's thread, and a task that fails
+    shouldn't stop the loop for the tasks after it.
+    """
+
+    monkeypatch.setattr("app.queue.task.settings.worker_asyncio", True)
+    QueueTask.shutdown_worker_process()
+    events.update(first=asyncio.Event(), second=asyncio.Event())
+    try:
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            # Each waits for the other, they would deadlock if run one by one.
+            futures = [
+                executor.submit(
+                    wait_for_other_task.apply,
+                    kwargs={"name": name, "other": other},
+                )
+                for name, other in [("first", "second"), ("second", "first")]
+            ]
+            results = [future.result(timeout=10) for future in futures]
+        assert [result.result for result in results] == ["queue-loop", "queue-loop"]
+
+        result = failing_task.apply()
+        assert result.state == "FAILURE"
+        assert isinstance(result.result, ValueError)
+        assert QueueTask._loop_thread.is_alive()
+        events.update(first=asyncio.Event(), second=asyncio.Event())
+        events["second"].set()
+        result = wait_for_other_task.apply(kwargs={"name": "first", "other": "second"})
+        assert result.result == "queue-loop"
+    finally:
+        QueueTask.shutdown_worker_process()
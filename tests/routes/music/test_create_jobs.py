@@ -0,0 +1,99 @@
+from litestar import status_codes
+
+from app.db.models.musicjob import MusicJobRespository, MusicJobStage
+
+URL = "/api/music/job/create/bulk"
+
+
+async def test_create_jobs_when_not_logged_in(client):
+    """
+    Test creating music jobs in bulk when not logged in. The endpoint should
+    return a 401 status.
+    """
+
+    response = await client.post(URL, json={"jobs": []})
+    assert response.status_code == status_codes.HTTP_401_UNAUTHORIZED
+
+
+async def test_create_jobs_without_album(client, create_and_login_user, test_video_url):
+    """
+    Test creating music jobs in bulk where a job has no album. The endpoint
+    should return a 400 status.
+    """
+
+    await create_and_login_user()
+    response = await client.post(
+        URL,
+        json={
+            "artist": "artist",
+            "jobs": [{"video_url": test_video_url, "title": "title"}],
+        },
+    )
+    assert response.status_code == status_codes.HTTP_400_BAD_REQUEST
+
+
+async def test_create_jobs(client, create_and_login_user, test_video_url, db_session):
+    """
+    Test creating music jobs in bulk with shared values. The endpoint should
+    return a 201 status with the ids of the jobs, which fall back to the shared
+    values.
+    """
+
+    await create_and_login_user()
+    response = await client.post(
+        URL,
+        json={
+            "artist": "artist",
+            "album": "album",
+            "jobs": [
+                {"video_url": test_video_url, "title": "first"},
+                {"video_url": test_video_url, "title": "second", "artist": "other"},
+            ],
+        },
+    )
+    assert response.status_code == status_codes.HTTP_201_CREATED
+    ids = response.json()["ids"]
+    assert len(ids) == 2
+
+    music_jobs_repo = MusicJobRespository(session=db_session)
+    music_jobs = {
+        str(music_job.id): music_job for music_job in await music_jobs_repo.list()
+    }
+    assert set(music_jobs) == set(ids)
+    first, second = music_jobs[ids[0]], music_jobs[ids[1]]
+    assert first.title == "first"
+    assert first.artist == "artist"
+    assert first.album == "album"
+    assert first.stage == MusicJobStage.UPLOADED
+    assert second.title == "second"
+    assert second.artist == "other"
+    assert second.album == "album"
+
+
+async def test_create_jobs_with_invalid_artwork(
+    client, create_and_login_user, test_video_url, db_session
+):
+    """
+    Test creating music jobs in bulk where the artwork of a job can't be
+    resolved. The endpoint should return a 400 status without creating any
+    jobs.
+    """
+
+    await create_and_login_user()
+    response = await client.post(
+        URL,
+        json={
+            "artist": "artist",
+            "album": "album",
+            "jobs": [
+                {"video_url": test_video_url, "title": "first"},
+                {
+                    "video_url": test_video_url,
+                    "title": "second",
+                    "artwork_url": "data:image/png;base64,abc",
+                },
+            ],
+        },
+    )
+    assert response.status_code == status_codes.HTTP_400_BAD_REQUEST
+    assert await MusicJobRespository(session=db_session).count() == 0
@@ -0,0 +1,170 @@
+import asyncio
+import json
+from queue import Empty
+
+import pytest
+from litestar import status_codes
+from litestar.exceptions import WebSocketDisconnect
+
+from app.pubsub import OverflowPolicy, PubSub
+from app.routes.music.controllers.job import music_job_updates
+from app.services import redispool
+
+URL = "/api/music/job/listen"
+WS_URL = "/api/music/job/listen/ws"
+
+
+def get_channel(email: str):
+    return PubSub.get_user_channel(PubSub.Channels.MUSIC_JOB_UPDATE, email)
+
+
+def get_update(job_id: str, status: str = "STARTED"):
+    return json.dumps({"id": job_id, "status": status})
+
+
+async def publish_updates(
+    channel: str, updates: list[str], wait_for_listener: bool = False, delay: float = 0
+):
+    # Runs on the loop of the app, which owns the redis pool.
+    redis = redispool.get_client()
+    if wait_for_listener:
+        async with asyncio.timeout(10):
+            while not (await redis.pubsub_numsub(channel))[0][1]:
+                await asyncio.sleep(0.1)
+    await asyncio.sleep(delay)
+    pubsub = PubSub(channels=[channel], log_max_length=10)
+    await pubsub.publish_many(updates)
+    return await pubsub.read_log(channel=channel)
+
+
+async def trim_updates(channel: str):
+    await redispool.get_client().xtrim(
+        PubSub.get_log_key(channel), maxlen=1, approximate=False
+    )
+
+
+async def test_listen_jobs_when_not_logged_in(client):
+    """
+    Test listening to music job updates when not logged in. The endpoints
+    should respond with a 401 status.
+    """
+
+    response = await client.get(URL)
+    assert response.status_code == status_codes.HTTP_401_UNAUTHORIZED
+    with pytest.raises(WebSocketDisconnect):
+        with await client.websocket_connect(WS_URL):
+            pass
+
+
+async def test_listen_jobs_ws(client, create_and_login_user, create_user):
+    """
+    Test listening to music job updates over a websocket. Only the updates of
+    the logged in user should be received, with their event ids.
+    """
+
+    # Read before logging in expires it.
+    other_email = (await create_user()).email
+    user = await create_and_login_user()
+    with await client.websocket_connect(WS_URL) as websocket:
+        client.blocking_portal.call(
+            publish_updates, get_channel(other_email), [get_update("2")]
+        )
+        ((event_id, _),) = client.blocking_portal.call(
+            publish_updates, get_channel(user.email), [get_update("1")], True
+        )
+        assert websocket.receive_json(timeout=10) == {
+            "id": event_id,
+            "data": {"id": "1", "status": "STARTED"},
+        }
+        with pytest.raises(Empty):
+            websocket.receive(timeout=1)
+
+
+async def test_listen_jobs_ws_resume(client, create_and_login_user):
+    """
+    Test listening to music job updates over a websocket with the id of an
+    update that was already received. The updates after it should be
+    received from the log.
+    """
+
+    user = await create_and_login_user()
+    log = client.blocking_portal.call(
+        publish_updates,
+        get_channel(user.email),
+        [get_update("1"), get_update("2"), get_update("3")],
+    )
+    with await client.websocket_connect(
+        WS_URL, params={"last_event_id": log[0][0]}
+    ) as websocket:
+        for event_id, data in log[1:]:
+            assert websocket.receive_json(timeout=10) == {
+                "id": event_id,
+                "data": json.loads(data),
+            }
+
+
+async def test_listen_jobs_sse(client, create_and_login_user, create_user, monkeypatch):
+    """
+    Test listening to music job updates over server sent events with the id of
+    an update that was already received. The updates after it should be sent
+    from the log, with keepalive comments while idle and without the updates
+    of other users. The stream should end when the listener overflows.
+    """
+
+    # Any live update overflows the listener and ends the stream.
+    monkeypatch.setattr(music_job_updates, "queue_size", 0)
+    monkeypatch.setattr(music_job_updates, "overflow_policy", OverflowPolicy.DISCONNECT)
+    monkeypatch.setattr(
+        "app.routes.music.controllers.job.settings.pubsub_keepalive_interval", 0.1
+    )
+    # Read before logging in expires it.
+    other_email = (await create_user()).email
+    user = await create_and_login_user()
+    log = client.blocking_portal.call(
+        publish_updates,
+        get_channel(user.email),
+        [get_update("1"), get_update("2"), get_update("3")],
+    )
+    client.blocking_portal.start_task_soon(
+        publish_updates, get_channel(other_email), [get_update("4")]
+    )
+    client.blocking_portal.start_task_soon(
+        publish_updates, get_channel(user.email), [get_update("5")], True, 1
+    )
+
+    response = await client.get(URL, headers={"Last-Event-ID": log[0][0]})
+    assert response.status_code == status_codes.HTTP_200_OK
+    events = [event for event in response.text.split("\r\n\r\n") if event]
+    assert events[:2] == [
+        f"id: {event_id}\r\ndata: {data}" for event_id, data in log[1:]
+    ]
+    assert events[2:]
+    assert all(event.startswith(": keepalive") for event in events[2:])
+
+
+async def test_listen_jobs_sse_trimmed(client, create_and_login_user, monkeypatch):
+    """
+    Test listening to music job updates over server sent events with the id of
+    an update that was trimmed from the log. A reset event should be sent
+    instead of the updates that are left in the log.
+    """
+
+    # Any live update overflows the listener and ends the stream.
+    monkeypatch.setattr(music_job_updates, "queue_size", 0)
+    monkeypatch.setattr(music_job_updates, "overflow_policy", OverflowPolicy.DISCONNECT)
+    user = await create_and_login_user()
+    log = client.blocking_portal.call(
+        publish_updates,
+        get_channel(user.email),
+        [get_update("1"), get_update("2"), get_update("3")],
+    )
+    client.blocking_portal.call(trim_updates, get_channel(user.email))
+    client.blocking_portal.start_task_soon(
+        publish_updates, get_channel(user.email), [get_update("4")], True
+    )
+
+    response = await client.get(URL, headers={"Last-Event-ID": log[0][0]})
+    assert response.status_code == status_codes.HTTP_200_OK
+    events = [event for event in response.text.split("\r\n\r\n") if event]
+    assert events[0] == "event: reset\r\ndata: reset"
+    assert not any(event.startswith("id:") for event in events)
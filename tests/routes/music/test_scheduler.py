@@ -0,0 +1,42 @@
+from litestar import status_codes
+
+URL = "/api/music/job/scheduler"
+
+
+async def test_get_scheduler_stats_as_non_admin(client, create_and_login_user):
+    """
+    Test getting the music job scheduler stats as a regular user. The endpoint
+    should return a 403 status.
+    """
+
+    await create_and_login_user()
+    response = await client.get(URL)
+    assert response.status_code == status_codes.HTTP_403_FORBIDDEN
+
+
+async def test_get_scheduler_stats(client, create_and_login_user, test_audio):
+    """
+    Test getting the music job scheduler stats as an admin after creating a job.
+    The endpoint should return a 200 status with the wait times of the user.
+    """
+
+    user = await create_and_login_user(admin=True)
+    response = await client.post(
+        "/api/music/job/create",
+        data={
+            "title": "title",
+            "artist": "artist",
+            "album": "album",
+        },
+        files={"file": ("dripdrop.mp3", test_audio, "audio/mpeg")},
+    )
+    assert response.status_code == status_codes.HTTP_201_CREATED
+
+    response = await client.get(URL)
+    assert response.status_code == status_codes.HTTP_200_OK
+    json = response.json()
+    assert json["inFlight"] == 1
+    assert len(json["users"]) == 1
+    assert json["users"][0]["user"] == user.email
+    assert json["users"][0]["pending"] == 0
+    assert json["users"][0]["dispatched"] == 1
@@ -0,0 +1,308 @@
+import asyncio
+import json
+
+import pytest
+
+from app.pubsub import (
+    OverflowPolicy,
+    PubSub,
+    PubSubHub,
+    PubSubSubscription,
+    SubscriptionOverflowError,
+)
+from app.services import redispool
+
+
+async def test_pubsub_user_channels(get_pubsub_channel_messages):
+    """
+    Test publishing messages to the channels of two users. A listener of one
+    user's channel should only receive that user's messages.
+    """
+
+    first_channel = PubSub.get_user_channel("TEST", "first@example.com")
+    second_channel = PubSub.get_user_channel("TEST", "second@example.com")
+    assert first_channel != second_channel
+
+    async def publish():
+        await asyncio.sleep(1)
+        await PubSub(channels=[second_channel]).publish_message("second")
+        await PubSub(channels=[first_channel]).publish_message("first")
+
+    task = asyncio.create_task(publish())
+    messages = await get_pubsub_channel_messages(first_channel, max_num_messages=1)
+    await task
+    assert messages[0]["data"] == b"first"
+
+
+async def test_pubsub_publish_many(redis, monkeypatch):
+    """
+    Test publishing several messages to two channels at once. Every channel
+    should receive and log the messages in order, with all of them sent in a
+    single round trip.
+    """
+
+    first_channel = PubSub.get_user_channel("TEST", "first@example.com")
+    second_channel = PubSub.get_user_channel("TEST", "second@example.com")
+    client = redispool.get_client()
+    pipeline = client.pipeline
+    executes = []
+
+    def _pipeline(*args, **kwargs):
+        pipe = pipeline(*args, **kwargs)
+        execute = pipe.execute
+
+        async def _execute(*args, **kwargs):
+            executes.append(len(pipe.command_stack))
+            return await execute(*args, **kwargs)
+
+        monkeypatch.setattr(pipe, "execute", _execute)
+        return pipe
+
+    monkeypatch.setattr(client, "pipeline", _pipeline)
+    pubsub = redis.pubsub()
+    await pubsub.subscribe(first_channel, second_channel)
+    try:
+        await PubSub(
+            channels=[first_channel, second_channel], log_max_length=10
+        ).publish_many(["1", "2", "3"])
+        messages = []
+        async with asyncio.timeout(10):
+            while len(messages) < 6:
+                message = await pubsub.get_message(
+                    ignore_subscribe_messages=True, timeout=1
+                )
+                if message:
+                    messages.append((message["channel"].decode(), message["data"]))
+    finally:
+        await pubsub.unsubscribe()
+        await pubsub.aclose()
+
+    # Three messages logged and published to two channels, then two expires.
+    assert executes == [14]
+    assert messages == [
+        (channel, data)
+        for data in [b"1", b"2", b"3"]
+        for channel in [first_channel, second_channel]
+    ]
+    for channel in [first_channel, second_channel]:
+        entries = await PubSub(channels=[channel]).read_log(channel)
+        assert [data for _, data in entries] == ["1", "2", "3"]
+
+
+async def test_pubsub_hub(redis):
+    """
+    Test publishing messages to user channels while subscribed to a hub.
+    Every subscriber should only receive the messages of its channel with
+    their log ids, and the hub should only be subscribed to the channels that
+    have subscribers.
+    """
+
+    first_channel = PubSub.get_user_channel("TEST", "first@example.com")
+    second_channel = PubSub.get_user_channel("TEST", "second@example.com")
+    third_channel = PubSub.get_user_channel("TEST", "third@example.com")
+    hub = PubSubHub()
+    try:
+        async with (
+            hub.subscribe(channel=first_channel) as first,
+            hub.subscribe(channel=first_channel) as second,
+            hub.subscribe(channel=second_channel) as third,
+        ):
+            assert await redis.pubsub_numsub(
+                first_channel, second_channel, third_channel
+            ) == [
+                (first_channel.encode(), 1),
+                (second_channel.encode(), 1),
+                (third_channel.encode(), 0),
+            ]
+
+            await PubSub(channels=[first_channel], log_max_length=10).publish_message(
+                json.dumps({"id": 1})
+            )
+            await PubSub(channels=[second_channel], log_max_length=10).publish_message(
+                json.dumps({"id": 2})
+            )
+            async with asyncio.timeout(10):
+                first_id, first_data = await first.get()
+                assert json.loads(first_data) == {"id": 1}
+                assert await second.get() == (first_id, first_data)
+                _, third_data = await third.get()
+                assert json.loads(third_data) == {"id": 2}
+            assert not first.entries
+            assert not third.entries
+        assert await redis.pubsub_numsub(first_channel, second_channel) == [
+            (first_channel.encode(), 0),
+            (second_channel.encode(), 0),
+        ]
+    finally:
+        await hub.close()
+
+
+async def test_pubsub_hub_resume(redis):
+    """
+    Test subscribing to a hub with the id of a message that was already
+    received. The subscriber should receive the messages published after it
+    from the log, followed by new ones.
+    """
+
+    channel = PubSub.get_user_channel("TEST", "first@example.com")
+    pubsub = PubSub(channels=[channel], log_max_length=10)
+    await pubsub.publish_many(["1", "2", "3"])
+    (last_id, _), *_ = await pubsub.read_log(channel=channel)
+
+    hub = PubSubHub()
+    try:
+        async with hub.subscribe(channel=channel, last_id=last_id) as subscription:
+            await pubsub.publish_message("4")
+            async with asyncio.timeout(10):
+                messages = [(await subscription.get())[1] for _ in range(3)]
+            assert messages == ["2", "3", "4"]
+            assert not subscription.reset
+    finally:
+        await hub.close()
+
+
+async def test_pubsub_hub_resume_trimmed(redis):
+    """
+    Test subscribing to a hub with the id of a message that was trimmed from
+    the log. The subscription should be reset instead of replaying what is
+    left of the log, and only receive new messages.
+    """
+
+    channel = PubSub.get_user_channel("TEST", "first@example.com")
+    pubsub = PubSub(channels=[channel], log_max_length=10)
+    await pubsub.publish_many(["1", "2", "3"])
+    (last_id, _), *_ = await pubsub.read_log(channel=channel)
+    await redis.xtrim(PubSub.get_log_key(channel), maxlen=1, approximate=False)
+
+    hub = PubSubHub()
+    try:
+        async with hub.subscribe(channel=channel, last_id=last_id) as subscription:
+            assert subscription.reset
+            assert not subscription.backlog
+            await pubsub.publish_message("4")
+            async with asyncio.timeout(10):
+                _, data = await subscription.get()
+            assert data == "4"
+    finally:
+        await hub.close()
+
+
+async def test_pubsub_hub_transient(redis):
+    """
+    Test publishing a message without the log to a channel with hub
+    subscribers. The subscribers should receive it without a log id, between
+    the logged messages, and it should not be kept in the log.
+    """
+
+    channel = PubSub.get_user_channel("TEST", "first@example.com")
+    pubsub = PubSub(channels=[channel], log_max_length=10)
+    hub = PubSubHub(is_transient=lambda data: data.startswith("progress"))
+    try:
+        async with hub.subscribe(channel=channel) as subscription:
+            await pubsub.publish_message("started")
+            await pubsub.publish_message("progress", log=False)
+            await pubsub.publish_message("completed")
+            async with asyncio.timeout(10):
+                messages = [await subscription.get() for _ in range(3)]
+            assert [data for _, data in messages] == [
+                "started",
+                "progress",
+                "completed",
+            ]
+            assert messages[1][0] is None
+            assert [data for _, data in await pubsub.read_log(channel=channel)] == [
+                "started",
+                "completed",
+            ]
+    finally:
+        await hub.close()
+
+
+async def test_pubsub_hub_close_subscribed(redis):
+    """
+    Test closing a hub while it still has a subscriber. The subscription
+    should end without an error once its subscriber leaves, and the hub
+    should no longer be subscribed to its channel.
+    """
+
+    channel = PubSub.get_user_channel("TEST", "first@example.com")
+    hub = PubSubHub()
+    try:
+        async with hub.subscribe(channel=channel):
+            assert await redis.pubsub_numsub(channel) == [(channel.encode(), 1)]
+            await hub.close()
+        assert await redis.pubsub_numsub(channel) == [(channel.encode(), 0)]
+        assert hub.get_stats().subscribers == 0
+    finally:
+        await hub.close()
+
+
+async def test_pubsub_subscription_drop_oldest():
+    """
+    Test putting more messages on a subscription than its queue holds with the
+    drop oldest policy. The oldest messages should be dropped.
+    """
+
+    subscription = PubSubSubscription(
+        max_size=2, overflow_policy=OverflowPolicy.DROP_OLDEST
+    )
+    for i in range(1, 4):
+        subscription.put((f"{i}-0", str(i)))
+    assert subscription.dropped == 1
+    assert await subscription.get() == ("2-0", "2")
+    assert await subscription.get() == ("3-0", "3")
+
+
+async def test_pubsub_subscription_coalesce():
+    """
+    Test putting more messages on a subscription than its queue holds with the
+    coalesce policy. The queued message with the same key should be replaced
+    by the new one, which is delivered in order. The key of each message
+    should only be computed once.
+    """
+
+    keys = []
+
+    def coalesce_key(data: str):
+        keys.append(json.loads(data)["id"])
+        return keys[-1]
+
+    subscription = PubSubSubscription(
+        max_size=2, overflow_policy="coalesce", coalesce_key=coalesce_key
+    )
+    assert subscription.overflow_policy == OverflowPolicy.COALESCE
+    subscription.put(("1-0", json.dumps({"id": "a", "progress": 1})))
+    subscription.put(("2-0", json.dumps({"id": "b", "progress": 1})))
+    subscription.put(("3-0", json.dumps({"id": "a", "progress": 2})))
+    assert keys == ["a", "b", "a"]
+    assert subscription.coalesced == 1
+    assert subscription.dropped == 0
+    assert [json.loads((await subscription.get())[1]) for _ in range(2)] == [
+        {"id": "b", "progress": 1},
+        {"id": "a", "progress": 2},
+    ]
+
+
+async def test_pubsub_subscription_disconnect():
+    """
+    Test putting more messages on a subscription than its queue holds with the
+    disconnect policy. The subscription should end with an error.
+    """
+
+    subscription = PubSubSubscription(
+        max_size=2, overflow_policy=OverflowPolicy.DISCONNECT
+    )
+    for i in range(1, 4):
+        subscription.put((f"{i}-0", str(i)))
+    with pytest.raises(SubscriptionOverflowError):
+        await subscription.get()
+
+
+async def test_pubsub_subscription_invalid_policy():
+    """
+    Test creating a subscription with an overflow policy that doesn't exist.
+    It should fail with an error.
+    """
+
+    with pytest.raises(ValueError):
+        PubSubSubscription(max_size=2, overflow_policy="drop_newest")